@@ -0,0 +1,31 @@
+# Helpers shared by the benchmarks that run against an in-process moto backend
+import importlib.util
+import os
+import threading
+from botocore.client import BaseClient
+
+
+def serialize_calls(service='dynamodb'):
+    # moto applies concurrent conditional writes and transactions without isolation, unlike DynamoDB, and
+    # is not safe for writes while an index is being queried. Calls to the service are serialised, across
+    # every boto3 session, to keep its results linearizable. Use DynamoDB or DynamoDB Local for contention numbers.
+    lock = threading.Lock()
+    make_api_call = BaseClient._make_api_call
+
+    def serialized(client, operation_name, api_params):
+        if client.meta.service_model.service_name != service:
+            return make_api_call(client, operation_name, api_params)
+        with lock:
+            return make_api_call(client, operation_name, api_params)
+
+    BaseClient._make_api_call = serialized
+
+
+def load_handler(function_dir, module_name=None):
+    # Every function is a lambda_function module, load each under its own name with its prints silenced
+    module_name = module_name or os.path.basename(os.path.normpath(function_dir)).replace('-', '_')
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(function_dir, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.print = lambda *args, **kwargs: None
+    return module
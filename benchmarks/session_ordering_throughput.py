@@ -0,0 +1,159 @@
+# Benchmark of per-session ordered delivery (functions/post_generator_agent/session_ordering.py)
+# Measures message throughput as the number of concurrent sessions rises, with a fixed pool of
+# consumers standing in for concurrent Lambda invocations and a fixed simulated agent turn time.
+# With one session everything is serialised by the session lock, with more sessions than consumers
+# throughput should approach the unordered baseline.
+#
+# Usage:
+#   pip install -r benchmarks/requirements.txt
+#   python benchmarks/session_ordering_throughput.py --sessions 1,2,4,8,16,32 --workers 16 --turn-ms 50
+# Runs against an in-process moto DynamoDB by default, pass --endpoint-url to use DynamoDB Local.
+import argparse
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions', 'post_generator_agent'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('MEMORY_TABLE', 'benchmark-agent-memory-store')
+
+import boto3
+from moto_support import serialize_calls
+
+AGENT_NAME = 'post-generator-agent'
+
+
+def create_memory_table(endpoint_url):
+    dynamodb = boto3.client('dynamodb', endpoint_url=endpoint_url)
+    table_name = os.environ['MEMORY_TABLE']
+    if table_name in dynamodb.list_tables()['TableNames']:
+        dynamodb.delete_table(TableName=table_name)
+        dynamodb.get_waiter('table_not_exists').wait(TableName=table_name)
+    dynamodb.create_table(
+        TableName=table_name,
+        BillingMode='PAY_PER_REQUEST',
+        AttributeDefinitions=[
+            {'AttributeName': 'session_id', 'AttributeType': 'S'},
+            {'AttributeName': 'agent_name', 'AttributeType': 'S'},
+        ],
+        KeySchema=[
+            {'AttributeName': 'session_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'agent_name', 'KeyType': 'RANGE'},
+        ]
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=table_name)
+
+
+def run(session_ordering, sessions, messages_per_session, workers, turn_ms, ordered):
+    # Standard SQS delivers roughly but not strictly in send order, shuffle within a small window
+    messages = []
+    base = int(time.time() * 1000)
+    for seq in range(messages_per_session):
+        for s in range(sessions):
+            messages.append({'type': 'existing', 'session_id': f"session-{s}", 'seq': seq, 'sent_at': base + seq})
+    for i in range(0, len(messages), 4):
+        window = messages[i:i + 4]
+        random.shuffle(window)
+        messages[i:i + 4] = window
+    deliveries = queue.Queue()
+    for message in messages:
+        deliveries.put(message)
+
+    processed = defaultdict(list)
+    active = defaultdict(int)
+    stats = {'max_active': 0, 'done': 0}
+    lock = threading.Lock()
+    total = len(messages)
+
+    def process(task):
+        with lock:
+            active[task['session_id']] += 1
+            stats['max_active'] = max(stats['max_active'], active[task['session_id']])
+        time.sleep(turn_ms / 1000)
+        with lock:
+            active[task['session_id']] -= 1
+            processed[task['session_id']].append(task['seq'])
+            stats['done'] += 1
+        return None
+
+    def consumer():
+        while True:
+            with lock:
+                if stats['done'] >= total:
+                    return
+            try:
+                task = deliveries.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if not ordered:
+                process(task)
+                continue
+            session_id = task['session_id']
+            if task['type'] != 'drain':
+                session_ordering.enqueue(session_id, AGENT_NAME, str(uuid.uuid4()), task['sent_at'], task)
+            session_ordering.drain(
+                session_id, AGENT_NAME, str(uuid.uuid4()), process,
+                nudge=lambda delay, sid=session_id: deliveries.put({'type': 'drain', 'session_id': sid})
+            )
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=consumer) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    out_of_order = sum(
+        1 for seqs in processed.values() for a, b in zip(seqs, seqs[1:]) if b < a
+    )
+    return {
+        'mode': 'ordered' if ordered else 'unordered',
+        'sessions': sessions,
+        'messages': total,
+        'seconds': elapsed,
+        'throughput': total / elapsed,
+        'max_concurrent_per_session': stats['max_active'],
+        'out_of_order': out_of_order,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of per-session ordered delivery as concurrent sessions rise')
+    parser.add_argument('--sessions', default='1,2,4,8,16,32', help='comma separated numbers of concurrent sessions')
+    parser.add_argument('--messages-per-session', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=16, help='concurrent consumers, stand-in for Lambda concurrency')
+    parser.add_argument('--turn-ms', type=int, default=50, help='simulated agent processing time per message')
+    parser.add_argument('--endpoint-url', default=None, help='DynamoDB Local endpoint, defaults to in-process moto')
+    args = parser.parse_args()
+
+    mock = None
+    if args.endpoint_url is None:
+        from moto import mock_aws
+        mock = mock_aws()
+        mock.start()
+        serialize_calls()
+    else:
+        # boto3.resource() inside session_ordering picks the endpoint up from the environment
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = args.endpoint_url
+    try:
+        create_memory_table(args.endpoint_url)
+        import session_ordering
+        print(f"{'mode':<10} {'sessions':>8} {'messages':>8} {'seconds':>8} {'msg/s':>8} {'max conc':>8} {'out of order':>12}")
+        for sessions in [int(s) for s in args.sessions.split(',')]:
+            for ordered in (False, True):
+                r = run(session_ordering, sessions, args.messages_per_session, args.workers, args.turn_ms, ordered)
+                print(f"{r['mode']:<10} {r['sessions']:>8} {r['messages']:>8} {r['seconds']:>8.2f} "
+                      f"{r['throughput']:>8.1f} {r['max_concurrent_per_session']:>8} {r['out_of_order']:>12}")
+    finally:
+        if mock:
+            mock.stop()
+
+
+if __name__ == '__main__':
+    main()
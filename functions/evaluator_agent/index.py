@@ -1,39 +1,78 @@
 # Lambda function Implementation of an async Strands Agent that gets invoked via a task from SQS
 import json
+import time
 import uuid
-import boto3
 import logging
 import os
 from strands import Agent, tool
-from strands.models import BedrockModel
 
 import publish_evaluation
+import rate_limiter
+import model_router
+import checkpointing
+import claim_check
+import aws_clients
 
 logger = logging.getLogger(__name__)
 
 MEMORY_TABLE = os.environ.get('MEMORY_TABLE', 'dev-agent-memory-store')
 CALLBACK_SQS_URL = os.environ.get('CALLBACK_SQS_URL', None)
 AGENT_NAME = 'evaluator-agent'
+COMPLETED_SESSION_TTL_DAYS = int(os.environ.get('COMPLETED_SESSION_TTL_DAYS', '7'))
+# Tools that end the agent's part of the work, their result is reported asynchronously
+ASYNC_TOOLS = ['publish_evaluation']
 
-def save_to_agent_memory(session_id, messages, parent=None):
-    # Put messages () against the session_id in memory store
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(MEMORY_TABLE)
+def memory_table():
+    return aws_clients.table(MEMORY_TABLE)
+
+def save_to_agent_memory(session_id, messages, parent=None, checkpoint_of=None, tier=None, start=None):
+    # Update messages () against the session_id in memory store, keeping other attributes of the session
+    # checkpoint_of marks a checkpoint taken while processing the given message, by the run of the given model
+    # tier that started from the first `start` messages, final saves clear it
+    table = memory_table()
     logger.info(f"Saving {len(messages)} messages to agent memory for session_id {session_id}")
-    agent_memory_object = {
-        'session_id': session_id, 
-        'agent_name': AGENT_NAME,
-        'messages': messages,
-    }
+    update = 'SET messages = :messages'
+    # Large message contents are stored once in the blob store, memory keeps references to them
+    values = {':messages': claim_check.offload(messages)}
     if parent:
-        agent_memory_object['parent'] = parent
-    
-    table.put_item(Item=agent_memory_object)
+        update += ', parent = :parent'
+        values[':parent'] = parent
+    if checkpoint_of:
+        update += ', checkpoint_of = :checkpoint_of, checkpoint_tier = :tier, checkpoint_start = :start'
+        values.update({':checkpoint_of': checkpoint_of, ':tier': tier, ':start': start})
+    else:
+        update += ' REMOVE checkpoint_of, checkpoint_tier, checkpoint_start'
+
+    table.update_item(
+        Key={'session_id': session_id, 'agent_name': AGENT_NAME},
+        UpdateExpression=update,
+        ExpressionAttributeValues=values
+    )
+    return True
+
+def mark_session_completed(session_id, reason):
+    # Completed sessions are exported by the session archiver and then expire from the memory table,
+    # archive_pending keys the sparse index the archiver reads them from by completion date
+    table = memory_table()
+    completed_at = int(time.time())
+    logger.info(f"Session_id {session_id} completed ({reason}), expires in {COMPLETED_SESSION_TTL_DAYS} days")
+    table.update_item(
+        Key={'session_id': session_id, 'agent_name': AGENT_NAME},
+        UpdateExpression='SET session_status = :completed, completion_reason = :reason, completed_at = :completed_at, '
+                         'archive_pending = :date, #ttl = :ttl',
+        ExpressionAttributeNames={'#ttl': 'ttl'},
+        ExpressionAttributeValues={
+            ':completed': 'completed',
+            ':reason': reason,
+            ':completed_at': completed_at,
+            ':date': time.strftime('%Y-%m-%d', time.gmtime(completed_at)),
+            ':ttl': completed_at + COMPLETED_SESSION_TTL_DAYS * 24 * 3600,
+        }
+    )
     return True
 
 def load_from_agent_memory(session_id):
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(MEMORY_TABLE)
+    table = memory_table()
     logger.info(f"Loading messages from agent memory for session_id {session_id}")
     # Load messages from agent memory of given session_id for this AGENT_NAME
     response = table.get_item(Key={'session_id': session_id, 'agent_name': AGENT_NAME})
@@ -43,6 +82,23 @@ def load_from_agent_memory(session_id):
     logger.info(f"Loaded {len(messages)} messages from agent memory of {AGENT_NAME} for session_id: {session_id}")
     return messages, parent
 
+def load_checkpoint(session_id, message_id):
+    # Checkpoint of an earlier, interrupted, processing of the same message: its messages, the model tier
+    # that wrote it and the number of messages that tier's run started from
+    if not message_id:
+        return None
+    table = memory_table()
+    response = table.get_item(Key={'session_id': session_id, 'agent_name': AGENT_NAME}, ConsistentRead=True)
+    item = response.get('Item', {})
+    if item.get('checkpoint_of') != message_id:
+        return None
+    logger.info(f"Found checkpoint of message {message_id} with {len(item.get('messages', []))} messages for session_id {session_id}")
+    return {
+        'messages': item.get('messages', []),
+        'tier': item.get('checkpoint_tier'),
+        'start': int(item.get('checkpoint_start', 0)),
+    }
+
 def prepare(task) -> Agent:
     type = task.get('type', None)
     parent = task.get('parent',None)
@@ -69,8 +125,20 @@ def prepare(task) -> Agent:
         assert task_description is not None, "Task description is not specified"
 
         if parent:
+            # One session per requesting tool use, evaluations requested in the same turn run side by side
             session_id = parent['session_id']
-            logger.info(f"Reusing parent session_id: {session_id}")
+            if parent.get('tool_use_id'):
+                session_id = f"{session_id}#{parent['tool_use_id']}"
+            logger.info(f"Using parent derived session_id: {session_id}")
+        elif task.get('message_id'):
+            # Derive the session_id from the message, so a redelivered message finds its checkpoint
+            session_id = str(uuid.uuid5(uuid.NAMESPACE_URL, task['message_id']))
+            logger.info(f"New session_id: {session_id}")
+            parent = {
+                'agent_name': AGENT_NAME,
+                'session_id': session_id,
+                'callback_sqs': CALLBACK_SQS_URL
+            }
         else:
             # Create a new session_id UUID
             session_id = str(uuid.uuid4())
@@ -132,8 +200,59 @@ def lambda_handler(event, context):
         }
     
     # Extract the first (and only) message
-    record = json.loads(event['Records'][0]['body'])
+    sqs_record = event['Records'][0]
+    record = json.loads(sqs_record['body'])
+    # Identity of the task across deferrals, checkpoints are keyed by it
+    record.setdefault('message_id', sqs_record['messageId'])
+
+    delay = process(record, context)
+    if delay is not None:
+        rate_limiter.defer(CALLBACK_SQS_URL, json.dumps(record), delay)
+
+def process(record, context):
+    # Runs the task, returns seconds to wait before retrying when Bedrock had no capacity for it
+    try:
+        run_agent(record, context.get_remaining_time_in_millis)
+    except rate_limiter.CapacityUnavailable as e:
+        # Admission control, hand the message back to SQS instead of waiting for Bedrock capacity
+        return e.delay_seconds
+    except Exception as e:
+        if checkpointing.is_time_budget_exhausted(e):
+            # Progress is checkpointed, a fresh invocation resumes right away
+            logger.info(f"Invocation is about to time out, requeueing message {record.get('message_id')}")
+            return 0
+        if not rate_limiter.is_throttling_error(e):
+            raise
+        logger.warning(f"Bedrock throttled the invocation, deferring the message: {e}")
+        return rate_limiter.throttle_delay()
+    return None
+
+def step_for(task):
+    # Workflow step of the task, used to pick the model tier
+    return 'evaluate' if task.get('type') == 'new' else 'report'
+
+def is_acceptable(waiting, new_messages):
+    # Output is well-formed once the evaluation has been published back to the requester
+    return waiting
+
+def run_agent(record, remaining_ms=None):
     session_id, history, prompt, parent = prepare(record)
+    step = step_for(record)
+    message_id = record.get('message_id')
+    tiers = model_router.escalation_path(model_router.route(AGENT_NAME, step))
+    # Every tier starts from the session history followed by the prompt
+    start = history + [{'role': 'user', 'content': [{'text': prompt}]}]
+    messages, finished = start, False
+
+    checkpoint = load_checkpoint(session_id, message_id)
+    if checkpoint is not None:
+        # The checkpoint already holds the prompt, resuming without it keeps the model from repeating the task
+        start = checkpoint['messages'][:checkpoint['start']]
+        messages, finished = checkpointing.resume_point(checkpoint['messages'], ASYNC_TOOLS)
+        if checkpoint['tier'] in tiers:
+            # Continue the escalation at the tier that wrote the checkpoint
+            tiers = tiers[tiers.index(checkpoint['tier']):]
+        logger.info(f"Resuming from checkpoint of tier {checkpoint['tier']} with {len(messages)} messages")
 
     system_prompt = """
     You are a specialized content evaluator for Unicorn Rentals, a company that offers unicorns for rent that kids and grown-ups can play with.
@@ -158,26 +277,45 @@ def lambda_handler(event, context):
     Your evaluation should be thorough but concise.
     Once evaluation is complete, publish your evaluations.
     """
-    # Create model
-    model = BedrockModel(
-        model_id="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-        region_name="us-east-1"
-    )
-
-    # Create agent
-    agent = Agent(
-        system_prompt=system_prompt,
-        model=model,
-        tools=[publish_evaluation],
-        messages=history,
-    )
-    
-    result = agent(prompt, session_id=session_id, parent=parent)
+    for tier in tiers:
+        if finished:
+            # The checkpointed run ended before its final save, its output is checked like a fresh one
+            waiting = messages[-1]['role'] != 'assistant'
+        else:
+            model_id = model_router.model_id(tier)
+            with rate_limiter.lease(model_id):
+                # Checkpoint after every model turn and tool result, with the tier and where its run started
+                checkpoint_handler = checkpointing.CheckpointCallbackHandler(
+                    save=lambda checkpointed, tier=tier: save_to_agent_memory(
+                        session_id, checkpointed, parent, checkpoint_of=message_id, tier=tier, start=len(start)),
+                    remaining_ms=remaining_ms
+                )
+                # Create agent with claim-checks resolved for the model
+                agent = Agent(
+                    system_prompt=system_prompt,
+                    model=model_router.model(tier),
+                    tools=[publish_evaluation],
+                    messages=claim_check.resolve(messages),
+                    callback_handler=checkpoint_handler,
+                    # No retries in the event loop, throttling reaches the rate limiter and the message is deferred
+                    retry_strategy=None,
+                )
+                checkpoint_handler.agent = agent
+                started = time.perf_counter()
+                result = agent(session_id=session_id, parent=parent)
+                latency_ms = int((time.perf_counter() - started) * 1000)
+            logger.info(f"Model tier {tier} ({model_id}) completed {AGENT_NAME} step `{step}` in {latency_ms} ms")
+            logger.info(str(result))
+            messages = agent.messages
+            waiting = result.state.get("stop_event_loop", False)
+        if tier == tiers[-1] or is_acceptable(waiting, messages[len(start):]):
+            break
+        logger.warning(f"Output of {tier} tier for step `{step}` is not acceptable, escalating")
+        # Every escalation starts over from the same messages
+        messages, finished = start, False
 
-    if result.state.get("stop_event_loop", False):
+    if waiting:
         logger.info("Agent needs to wait for tool result. Saving state and sleeping.")
-    save_to_agent_memory(session_id, agent.messages, parent)
-
-    logger.info(str(result))
-
-
+    save_to_agent_memory(session_id, messages, parent)
+    # The evaluation has been reported (or could not be produced), nothing else happens in this session
+    mark_session_completed(session_id, 'evaluated' if waiting else 'ended')
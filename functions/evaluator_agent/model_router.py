@@ -0,0 +1,62 @@
+import logging
+import os
+import threading
+from botocore.config import Config
+from strands.models import BedrockModel
+
+# Picks a model tier per agent and per step of the agent's workflow.
+# Mechanical steps (calling the next tool, reporting an evaluation) run on the small tier,
+# creative generation runs on the large tier. Outputs that fail an agent's own acceptance check
+# are escalated along TIERS to the next larger tier.
+logger = logging.getLogger(__name__)
+
+REGION = os.environ.get('BEDROCK_REGION', 'us-east-1')
+# Concurrent Agent calls sharing a model share its connection pool, the worker sizes it to its concurrency
+MAX_POOL_CONNECTIONS = int(os.environ.get('BEDROCK_MAX_POOL_CONNECTIONS', '10'))
+TIERS = ['small', 'large']
+MODEL_IDS = {
+    'small': os.environ.get('SMALL_MODEL_ID', 'us.anthropic.claude-3-5-haiku-20241022-v1:0'),
+    'large': os.environ.get('LARGE_MODEL_ID', 'us.anthropic.claude-3-7-sonnet-20250219-v1:0'),
+}
+DEFAULT_TIER = 'large'
+ROUTES = {
+    # (agent name, step): tier
+    ('post-generator-agent', 'generate'): 'large',
+    ('post-generator-agent', 'revise'): 'large',
+    ('post-generator-agent', 'request_approval'): 'small',
+    ('post-generator-agent', 'publish'): 'small',
+    ('post-generator-agent', 'speculate'): 'small',
+    ('evaluator-agent', 'evaluate'): 'small',
+    ('evaluator-agent', 'report'): 'small',
+}
+
+# Models are reused across invocations of a warm Lambda, each holds its own Bedrock client
+_models = {}
+_models_lock = threading.Lock()
+
+
+def route(agent_name, step):
+    tier = ROUTES.get((agent_name, step), DEFAULT_TIER)
+    logger.info(f"Routing {agent_name} step `{step}` to {tier} tier ({MODEL_IDS[tier]})")
+    return tier
+
+
+def escalation_path(tier):
+    # The routed tier followed by every larger tier
+    return TIERS[TIERS.index(tier):]
+
+
+def model_id(tier):
+    return MODEL_IDS[tier]
+
+
+def model(tier):
+    # Built once per tier on its own boto3 session, concurrent agent runs share the thread safe client
+    with _models_lock:
+        if tier not in _models:
+            _models[tier] = BedrockModel(
+                model_id=MODEL_IDS[tier],
+                region_name=REGION,
+                boto_client_config=Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+            )
+        return _models[tier]
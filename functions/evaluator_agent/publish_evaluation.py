@@ -1,10 +1,11 @@
 import logging
 import os
-import boto3
 import json
 from typing import Any
 from botocore.exceptions import ClientError
 from strands.types.tools import ToolResult, ToolUse
+import claim_check
+import aws_clients
 
 # Initialize logging and set paths
 logger = logging.getLogger(__name__)
@@ -34,6 +35,15 @@ def publish_evaluation(tool: ToolUse, **kwargs: Any) -> ToolResult:
     parent = request_state.get('parent', kwargs.get("parent", None))
     logger.debug(f"Session ID: {session_id}")
 
+    # Reject malformed evaluations without reporting them, so the agent retries or gets escalated to a larger model
+    if 'APPROVED' not in content.upper() and 'REJECTED' not in content.upper():
+        logger.warning(f"Evaluation for session_id {session_id} has no APPROVED or REJECTED decision")
+        return {
+            "toolUseId": tool_use_id,
+            "status": "error",
+            "content": [{"text": "The evaluation must contain a clear APPROVED or REJECTED decision, evaluation was not reported"}]
+        }
+
     # Send an existing task to report to parent agent via SQS
     # Structure of an existing task
     #  Result of successful tool execution
@@ -49,8 +59,10 @@ def publish_evaluation(tool: ToolUse, **kwargs: Any) -> ToolResult:
     #         }
     #     }]
     # }
+    # The evaluator session is per tool use, report to the session of the requesting agent
+    parent_session_id = parent['session_id']
     message_body = {
-        "session_id": session_id,
+        "session_id": parent_session_id,
         "type": "existing",
         "toolName": "evaluator_agent",
         "body": [{
@@ -61,14 +73,14 @@ def publish_evaluation(tool: ToolUse, **kwargs: Any) -> ToolResult:
             }
         }]
     }
-    logger.info(f'Reporting evaluation for session_id {session_id} with the toolResult {message_body["body"][0]["toolResult"]}')
-    sqs = boto3.client('sqs')
-    sqs.send_message(
+    logger.info(f'Reporting evaluation for session_id {parent_session_id} with the toolResult {message_body["body"][0]["toolResult"]}')
+    aws_clients.client('sqs').send_message(
         QueueUrl=POST_GENERATOR_AGENT_SQS_URL,
-        MessageBody=json.dumps(message_body),
+        # Long evaluations travel as a claim-check reference, the post generator resolves it when resuming
+        MessageBody=json.dumps(claim_check.offload(message_body)),
         MessageAttributes={
             'session_id': {
-                'StringValue': session_id,
+                'StringValue': parent_session_id,
                 'DataType': 'String'
             },
             'tool_use_id': {
@@ -0,0 +1,196 @@
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from botocore.exceptions import ClientError
+import aws_clients
+
+# Distributed admission control for Bedrock calls shared by every Lambda instance of every agent.
+# A single DynamoDB item per model holds
+#   - a token bucket (`tokens`, `refilled_at`) that caps the rate at which invocations may start
+#   - an adaptive concurrency limit (`limit`) that grows additively on success and halves on throttling (AIMD)
+#   - the set of in-flight `leases` with their expiry, so crashed invocations cannot leak capacity
+# The item is updated with optimistic locking on `version`.
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_TABLE = os.environ.get('RATE_LIMIT_TABLE', os.environ.get('MEMORY_TABLE', 'agent-memory-store'))
+RATE_LIMIT_PARTITION = '__bedrock_rate_limiter__'
+TOKENS_PER_SECOND = float(os.environ.get('BEDROCK_TOKENS_PER_SECOND', '1'))
+BURST_CAPACITY = float(os.environ.get('BEDROCK_BURST_CAPACITY', '5'))
+MIN_CONCURRENCY = float(os.environ.get('BEDROCK_MIN_CONCURRENCY', '1'))
+MAX_CONCURRENCY = float(os.environ.get('BEDROCK_MAX_CONCURRENCY', '20'))
+LEASE_SECONDS = int(os.environ.get('BEDROCK_LEASE_SECONDS', '900'))
+MAX_DEFER_SECONDS = 900  # SQS DelaySeconds upper bound
+MIN_DEFER_SECONDS = 1
+THROTTLE_DEFER_SECONDS = int(os.environ.get('BEDROCK_THROTTLE_DEFER_SECONDS', '30'))
+MAX_ATTEMPTS = 5
+
+
+class CapacityUnavailable(Exception):
+    def __init__(self, model_id, delay_seconds):
+        super().__init__(f"No Bedrock capacity for {model_id}, retry in {delay_seconds}s")
+        self.model_id = model_id
+        self.delay_seconds = delay_seconds
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _table():
+    return aws_clients.table(RATE_LIMIT_TABLE)
+
+
+def _load(table, model_id, now):
+    item = table.get_item(
+        Key={'session_id': RATE_LIMIT_PARTITION, 'agent_name': model_id},
+        ConsistentRead=True
+    ).get('Item')
+    if not item:
+        return {
+            'tokens': BURST_CAPACITY,
+            'refilled_at': now,
+            'limit': MAX_CONCURRENCY,
+            'leases': {},
+            'version': 0,
+        }
+    return {
+        'tokens': float(item['tokens']),
+        'refilled_at': int(item['refilled_at']),
+        'limit': float(item['limit']),
+        # Drop leases of invocations that died without releasing them
+        'leases': {k: int(v) for k, v in item.get('leases', {}).items() if int(v) > now},
+        'version': int(item['version']),
+    }
+
+
+def _store(table, model_id, state, expected_version):
+    item = {
+        'session_id': RATE_LIMIT_PARTITION,
+        'agent_name': model_id,
+        'tokens': Decimal(str(round(state['tokens'], 6))),
+        'refilled_at': state['refilled_at'],
+        'limit': Decimal(str(round(state['limit'], 6))),
+        'leases': state['leases'],
+        'version': expected_version + 1,
+    }
+    if expected_version == 0:
+        return aws_clients.conditional(
+            table.put_item, Item=item, ConditionExpression='attribute_not_exists(session_id)') is not None
+    return aws_clients.conditional(
+        table.put_item, Item=item, ConditionExpression='version = :v',
+        ExpressionAttributeValues={':v': expected_version}) is not None
+
+
+def _update(model_id, mutate):
+    # Read-modify-write the limiter item, retrying when another instance updated it concurrently
+    table = _table()
+    for _ in range(MAX_ATTEMPTS):
+        now = _now_ms()
+        state = _load(table, model_id, now)
+        version = state['version']
+        # Refill the bucket for the time elapsed since the last update
+        elapsed = max(0, now - state['refilled_at']) / 1000.0
+        state['tokens'] = min(BURST_CAPACITY, state['tokens'] + elapsed * TOKENS_PER_SECOND)
+        state['refilled_at'] = now
+        result = mutate(state, now)
+        if _store(table, model_id, state, version):
+            return result
+    raise RuntimeError(f"Could not update rate limiter state for {model_id}, too much contention")
+
+
+def acquire(model_id):
+    """
+    Try to admit one agent invocation against the given model.
+
+    Returns:
+    tuple: (lease_id, 0) when admitted, or (None, delay_seconds) when the caller should retry later
+    """
+    lease_id = str(uuid.uuid4())
+
+    def mutate(state, now):
+        if len(state['leases']) >= int(state['limit']):
+            # Concurrency window is full, back off exponentially in how far over the (possibly just halved) limit we are
+            overflow = len(state['leases']) - int(state['limit']) + 1
+            return None, MIN_DEFER_SECONDS * 2 ** min(overflow, 9)
+        if state['tokens'] < 1:
+            return None, (1 - state['tokens']) / TOKENS_PER_SECOND
+        state['tokens'] -= 1
+        state['leases'][lease_id] = now + LEASE_SECONDS * 1000
+        return lease_id, 0
+
+    try:
+        lease, delay = _update(model_id, mutate)
+    except RuntimeError as e:
+        logger.warning(str(e))
+        return None, MIN_DEFER_SECONDS
+    delay = int(min(MAX_DEFER_SECONDS, max(MIN_DEFER_SECONDS, delay))) if lease is None else 0
+    logger.info(f"Rate limiter for {model_id}: {'admitted' if lease else f'deferred by {delay}s'}")
+    return lease, delay
+
+
+def release(model_id, lease_id, throttled=False):
+    """
+    Return a lease and feed the outcome into the AIMD concurrency limit.
+    On throttling the limit is halved and the bucket emptied, otherwise the limit grows by 1/limit.
+    """
+    def mutate(state, now):
+        state['leases'].pop(lease_id, None)
+        if throttled:
+            state['limit'] = max(MIN_CONCURRENCY, state['limit'] / 2)
+            state['tokens'] = 0
+        else:
+            state['limit'] = min(MAX_CONCURRENCY, state['limit'] + 1 / state['limit'])
+        return state['limit']
+
+    try:
+        limit = _update(model_id, mutate)
+        logger.info(f"Rate limiter for {model_id}: released lease, throttled={throttled}, concurrency limit {limit:.2f}")
+    except RuntimeError as e:
+        # The lease expires on its own, the limit adapts on the next release
+        logger.warning(str(e))
+
+
+@contextmanager
+def lease(model_id):
+    # Holds a lease for the duration of the block, raises CapacityUnavailable when not admitted
+    lease_id, delay = acquire(model_id)
+    if lease_id is None:
+        raise CapacityUnavailable(model_id, delay)
+    throttled = False
+    try:
+        yield lease_id
+    except Exception as e:
+        throttled = is_throttling_error(e)
+        raise
+    finally:
+        release(model_id, lease_id, throttled)
+
+
+def defer(queue_url, message_body, delay_seconds):
+    # Hand the message back to SQS instead of sleeping inside the Lambda
+    logger.info(f"Deferring message to {queue_url} by {delay_seconds}s")
+    aws_clients.client('sqs').send_message(
+        QueueUrl=queue_url,
+        MessageBody=message_body,
+        DelaySeconds=int(min(MAX_DEFER_SECONDS, max(0, delay_seconds)))
+    )
+
+
+def throttle_delay():
+    # Jittered delay for messages whose invocation was throttled mid-run, spreads out the retry wave
+    return random.randint(THROTTLE_DEFER_SECONDS // 2, THROTTLE_DEFER_SECONDS * 3 // 2)
+
+
+def is_throttling_error(error):
+    # Strands surfaces Bedrock throttling as ModelThrottledException, possibly wrapped by the event loop
+    while error is not None:
+        if type(error).__name__ == 'ModelThrottledException':
+            return True
+        if isinstance(error, ClientError) and error.response['Error']['Code'] in ('ThrottlingException', 'TooManyRequestsException'):
+            return True
+        error = error.__cause__ or getattr(error, 'original_exception', None)
+    return False
@@ -0,0 +1,45 @@
+import threading
+import boto3
+from botocore.exceptions import ClientError
+
+# AWS access shared by the modules of this function. boto3 sessions, and the resources built from them,
+# are not thread safe and the worker runs several messages side by side, so every thread keeps its own
+# session with its tables and clients and reuses them across messages.
+_local = threading.local()
+
+
+def _session():
+    if not hasattr(_local, 'session'):
+        _local.session = boto3.session.Session()
+        _local.tables = {}
+        _local.clients = {}
+    return _local.session
+
+
+def table(name):
+    session = _session()
+    if name not in _local.tables:
+        _local.tables[name] = session.resource('dynamodb').Table(name)
+    return _local.tables[name]
+
+
+def client(service):
+    session = _session()
+    if service not in _local.clients:
+        _local.clients[service] = session.client(service)
+    return _local.clients[service]
+
+
+def conditional(operation, **kwargs):
+    """
+    Run a conditional write
+
+    Returns:
+    dict: the response, or None instead of raising when the condition does not hold
+    """
+    try:
+        return operation(**kwargs)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
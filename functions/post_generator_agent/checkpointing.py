@@ -0,0 +1,70 @@
+import logging
+import os
+
+# Checkpoints the agent loop to memory after every completed model turn and tool result, so a
+# redelivered message resumes from the last checkpoint instead of replaying (and paying for) every turn.
+# The callback handler also stops the loop early when the invocation is about to time out.
+logger = logging.getLogger(__name__)
+
+MIN_REMAINING_MS = int(os.environ.get('CHECKPOINT_MIN_REMAINING_MS', '60000'))
+
+
+class InvocationTimeBudgetExhausted(Exception):
+    pass
+
+
+class CheckpointCallbackHandler:
+    def __init__(self, save, remaining_ms=None):
+        """
+        Parameters:
+        save (callable): persists the given list of messages
+        remaining_ms (callable): remaining time of the invocation in milliseconds
+        """
+        self.save = save
+        self.remaining_ms = remaining_ms
+        self.agent = None
+
+    def __call__(self, **kwargs):
+        # The event loop reports every new assistant message and every toolResult message with `message`
+        message = kwargs.get('message')
+        if message is None or self.agent is None:
+            return
+        messages = list(self.agent.messages)
+        if not messages or messages[-1] is not message:
+            messages.append(message)
+        self.save(messages)
+        if self.remaining_ms and self.remaining_ms() < MIN_REMAINING_MS:
+            raise InvocationTimeBudgetExhausted(f"Less than {MIN_REMAINING_MS} ms left, stopping after checkpoint")
+
+
+def resume_point(messages, async_tools):
+    """
+    Prepare checkpointed messages to continue the agent loop. The loop continues from them without a
+    new user message, a trailing toolUse turn runs its tools without calling the model again.
+
+    Returns:
+    tuple: (messages, waiting) where waiting is True when the checkpointed run already ended
+    waiting on an async tool or with a final answer, so there is nothing left to run
+    """
+    if not messages:
+        return messages, False
+    last = messages[-1]
+    if last['role'] == 'assistant':
+        if any('toolUse' in block for block in last['content']):
+            # Tool uses of this turn never got their results, run them
+            return messages, False
+        return messages, True
+    if len(messages) > 1:
+        tool_names = {block['toolUse']['name'] for block in messages[-2]['content'] if 'toolUse' in block}
+        if tool_names & set(async_tools):
+            return messages, True
+    return messages, False
+
+
+def is_time_budget_exhausted(error):
+    # The event loop may wrap exceptions raised by the callback handler
+    while error is not None:
+        if isinstance(error, InvocationTimeBudgetExhausted):
+            return True
+        error = error.__cause__ or getattr(error, 'original_exception', None)
+    return False
@@ -0,0 +1,120 @@
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+import aws_clients
+
+# Claim-check for large payloads. Strings and bytes above CLAIM_CHECK_THRESHOLD_BYTES are written once to
+# a content-addressed blob store and replaced by a reference, {'claimCheck': {'sha256': ..., 'size': ...}},
+# before they go into an SQS message body or the memory table. References pass untouched through queues,
+# memory saves and the join barrier and are resolved only when a model needs the content.
+# The store is the S3 bucket CLAIM_CHECK_BUCKET, or the directory CLAIM_CHECK_DIR as a local stand-in;
+# without either payloads stay inline.
+logger = logging.getLogger(__name__)
+
+CLAIM_CHECK_BUCKET = os.environ.get('CLAIM_CHECK_BUCKET', None)
+CLAIM_CHECK_DIR = os.environ.get('CLAIM_CHECK_DIR', None)
+CLAIM_CHECK_PREFIX = 'blobs/sha256/'
+THRESHOLD_BYTES = int(os.environ.get('CLAIM_CHECK_THRESHOLD_BYTES', '32768'))
+# Resolved blobs kept in memory, a warm container resolves the same history on every turn
+CACHE_SIZE = 64
+
+# Blobs this process already stored, every checkpoint offloads the whole history again
+_stored = set()
+
+
+class S3BlobStore:
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def put(self, digest, data):
+        aws_clients.client('s3').put_object(Bucket=self.bucket, Key=f"{CLAIM_CHECK_PREFIX}{digest}", Body=data)
+
+    def get(self, digest):
+        return aws_clients.client('s3').get_object(Bucket=self.bucket, Key=f"{CLAIM_CHECK_PREFIX}{digest}")['Body'].read()
+
+
+class LocalBlobStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, digest, data):
+        path = os.path.join(self.directory, digest)
+        if os.path.exists(path):
+            return
+        # Write and rename, readers never see a partial blob
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, digest):
+        with open(os.path.join(self.directory, digest), 'rb') as f:
+            return f.read()
+
+
+@functools.lru_cache(maxsize=1)
+def store():
+    if CLAIM_CHECK_BUCKET:
+        return S3BlobStore(CLAIM_CHECK_BUCKET)
+    if CLAIM_CHECK_DIR:
+        return LocalBlobStore(CLAIM_CHECK_DIR)
+    return None
+
+
+def is_reference(value):
+    return isinstance(value, dict) and set(value) == {'claimCheck'}
+
+
+def _check(value):
+    # Reference to the blob holding a single large string or bytes value
+    data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    digest = hashlib.sha256(data).hexdigest()
+    if digest not in _stored:
+        store().put(digest, data)
+        _stored.add(digest)
+        logger.info(f"Offloaded {len(data)} bytes to claim-check {digest}")
+    return {'claimCheck': {'sha256': digest, 'size': len(data), 'type': 'text' if isinstance(value, str) else 'bytes'}}
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _fetch(digest, type_):
+    data = store().get(digest)
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Claim-check {digest} is corrupted")
+    return data.decode('utf-8') if type_ == 'text' else data
+
+
+def offload(value):
+    """
+    Replace large strings and bytes anywhere in a JSON-like value by claim-check references
+
+    Returns:
+    the value, with the same structure, unchanged when no blob store is configured
+    """
+    if store() is None:
+        return value
+    if isinstance(value, dict):
+        return {k: offload(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [offload(v) for v in value]
+    if isinstance(value, (bytes, bytearray)) and len(value) > THRESHOLD_BYTES:
+        return _check(value)
+    # UTF-8 takes up to 4 bytes per character, skip encoding strings that cannot be over the threshold
+    if isinstance(value, str) and len(value) * 4 > THRESHOLD_BYTES and len(value.encode('utf-8')) > THRESHOLD_BYTES:
+        return _check(value)
+    return value
+
+
+def resolve(value):
+    # Inverse of offload, fetches every referenced blob
+    if is_reference(value):
+        reference = value['claimCheck']
+        return _fetch(reference['sha256'], reference.get('type', 'text'))
+    if isinstance(value, dict):
+        return {k: resolve(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v) for v in value]
+    return value
@@ -1,10 +1,11 @@
 import logging
 import os
-import boto3
 import json
 from typing import Any
 from botocore.exceptions import ClientError
 from strands.types.tools import ToolResult, ToolUse
+import claim_check
+import aws_clients
 
 # Initialize logging and set paths
 logger = logging.getLogger(__name__)
@@ -27,14 +28,7 @@ TOOL_SPEC = {
     }
 }
 
-def evaluator_agent(tool: ToolUse, **kwargs: Any) -> ToolResult:
-    tool_use_id = tool["toolUseId"]
-    content = tool["input"]["content"]
-    request_state = kwargs.get("request_state", {})
-    session_id = request_state.get('session_id', kwargs.get("session_id", None))
-    parent = request_state.get('parent', kwargs.get("parent", None))
-    logger.debug(f"Session ID: {session_id}")
-
+def request_evaluation(content, session_id, parent, tool_use_id):
     # Send a new task to the evaluator agent via SQS
     # Structure of a new task
     # {
@@ -56,13 +50,13 @@ def evaluator_agent(tool: ToolUse, **kwargs: Any) -> ToolResult:
         }
     }
     if parent:
-        message_body['parent'] = parent
-        message_body['parent']['tool_use_id'] = tool_use_id
-        
-    sqs = boto3.client('sqs')
-    sqs.send_message(
+        # Copy, several evaluations may be requested in the same turn
+        message_body['parent'] = dict(parent, tool_use_id=tool_use_id)
+
+    aws_clients.client('sqs').send_message(
         QueueUrl=EVALUATOR_AGENT_SQS_URL,
-        MessageBody=json.dumps(message_body),
+        # Large posts travel as a claim-check reference, the evaluator resolves it
+        MessageBody=json.dumps(claim_check.offload(message_body)),
         MessageAttributes={
             'session_id': {
                 'StringValue': session_id,
@@ -75,6 +69,16 @@ def evaluator_agent(tool: ToolUse, **kwargs: Any) -> ToolResult:
         }
     )
 
+def evaluator_agent(tool: ToolUse, **kwargs: Any) -> ToolResult:
+    tool_use_id = tool["toolUseId"]
+    content = tool["input"]["content"]
+    request_state = kwargs.get("request_state", {})
+    session_id = request_state.get('session_id', kwargs.get("session_id", None))
+    parent = request_state.get('parent', kwargs.get("parent", None))
+    logger.debug(f"Session ID: {session_id}")
+
+    request_evaluation(content, session_id, parent, tool_use_id)
+
     # Set the stop flag, so that the agent can sleep and store it's state in memory.
     request_state["stop_event_loop"] = True
     request_state["session_id"] = session_id
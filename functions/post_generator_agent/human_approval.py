@@ -1,10 +1,10 @@
 import logging
 import os
-import boto3
 import json
 from typing import Any
 from botocore.exceptions import ClientError
 from strands.types.tools import ToolResult, ToolUse
+import aws_clients
 
 # Initialize logging and set paths
 logger = logging.getLogger(__name__)
@@ -44,7 +44,7 @@ def send_approval_email(content_to_approve, session_id, tool_use_id):
         assert TOPIC_ARN is not None, "TOPIC_ARN is not specified"
         assert APPROVAL_API_ENDPOINT is not None, "APPROVAL_API_ENDPOINT is missing"
         # Create an SNS client
-        sns_client = boto3.client('sns')
+        sns_client = aws_clients.client('sns')
         
         # Create the approval and denial URLs
         approve_url = f"{APPROVAL_API_ENDPOINT}approve/{session_id}?toolUseId={tool_use_id}"
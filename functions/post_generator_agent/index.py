@@ -1,41 +1,127 @@
 # Lambda function Implementation of an async Strands Agent that gets invoked via a task from SQS
 import json
+import time
 import uuid
-import boto3
 import logging
 import os
 from strands import Agent
-from strands.models import BedrockModel
 # Local imports
 import human_approval
 import publish_post
 import evaluator_agent
+import rate_limiter
+import model_router
+import priority_lanes
+import session_ordering
+import checkpointing
+import claim_check
+import aws_clients
+import speculation
+import tool_barrier
 
 logger = logging.getLogger(__name__)
 
 MEMORY_TABLE = os.environ.get('MEMORY_TABLE', 'agent-memory-store')
 CALLBACK_SQS_URL = os.environ.get('CALLBACK_SQS_URL', None)
+DEAD_LETTER_SQS_URL = os.environ.get('DEAD_LETTER_SQS_URL', None)
 AGENT_NAME = 'post-generator-agent'
+COMPLETED_SESSION_TTL_DAYS = int(os.environ.get('COMPLETED_SESSION_TTL_DAYS', '7'))
+# Evaluation rounds after which the agent is instructed to give up
+MAX_ATTEMPTS = 3
+# Tools that stop the event loop until their result arrives via SQS
+ASYNC_TOOLS = ['evaluator_agent', 'human_approval']
 
-def save_to_agent_memory(session_id, messages, parent=None):
-    # Put messages () against the session_id in memory store
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(MEMORY_TABLE)
+SYSTEM_PROMPT = """
+    You are a creative social media manager for Unicorn Rentals, a company that offers unicorns for rent that kids and grown-ups can play with.
+
+    Your task is to create engaging social media posts for UniTok, our unicorn-themed social media platform.
+    Before publishing, you must request evaluation of the post to ensure your content adheres to our brand guidelines.
+
+    Process for creating and publishing posts:
+    1. Generate a creative post based on the user's request
+    2. Request evaluation to check if it meets our brand guidelines
+    3. If the post is REJECTED, revise the post based on feedback and evaluate again
+    4. Once the post is APPROVED, request human approval of the post
+    5. If the human approves the post then publish it to our platform
+    6. If the human denies the post, then restart the process
+
+    Important information about Unicorn Rentals:
+    - We offer unicorns in various colors: pink, blue, purple, green, yellow, and rainbow (our most popular)
+    - Our new product feature allows customers to pick their favorite color unicorn to rent
+    - Our target audience includes families with children, fantasy enthusiasts, and event planners
+    - Our brand voice is magical, playful, and family-friendly
+
+    When creating posts:
+    - Keep content family-friendly and positive
+    - Highlight the magical experience of spending time with unicorns
+    - Mention the new color selection feature when appropriate
+    - Use emojis sparingly but effectively
+    - Keep posts between 50-200 characters for optimal engagement
+    - If your posts are continously being rejected by evaluator and denied by humans then stop after 3 tries
+
+    Always show your thought process when creating posts, evaluating them, and making revisions.
+"""
+
+SPECULATION_PROMPT = """
+A post is waiting for human approval:
+
+{content}
+
+Write one alternative version of this post in case the human denies it. Take a different creative angle
+while following all guidelines. Reply with the text of the alternative post only.
+"""
+
+def memory_table():
+    return aws_clients.table(MEMORY_TABLE)
+
+def save_to_agent_memory(session_id, messages, parent=None, checkpoint_of=None, tier=None, start=None):
+    # Update messages () against the session_id in memory store, keeping other attributes of the session
+    # checkpoint_of marks a checkpoint taken while processing the given message, by the run of the given model
+    # tier that started from the first `start` messages, final saves clear it
+    table = memory_table()
     logger.info(f"Saving {len(messages)} messages to agent memory for session_id {session_id}")
-    agent_memory_object = {
-        'session_id': session_id, 
-        'agent_name': AGENT_NAME,
-        'messages': messages,
-    }
+    update = 'SET messages = :messages'
+    # Large message contents are stored once in the blob store, memory keeps references to them
+    values = {':messages': claim_check.offload(messages)}
     if parent:
-        agent_memory_object['parent'] = parent
-    
-    table.put_item(Item=agent_memory_object)
+        update += ', parent = :parent'
+        values[':parent'] = parent
+    if checkpoint_of:
+        update += ', checkpoint_of = :checkpoint_of, checkpoint_tier = :tier, checkpoint_start = :start'
+        values.update({':checkpoint_of': checkpoint_of, ':tier': tier, ':start': start})
+    else:
+        update += ' REMOVE checkpoint_of, checkpoint_tier, checkpoint_start'
+
+    table.update_item(
+        Key={'session_id': session_id, 'agent_name': AGENT_NAME},
+        UpdateExpression=update,
+        ExpressionAttributeValues=values
+    )
+    return True
+
+def mark_session_completed(session_id, reason):
+    # Completed sessions are exported by the session archiver and then expire from the memory table,
+    # archive_pending keys the sparse index the archiver reads them from by completion date
+    table = memory_table()
+    completed_at = int(time.time())
+    logger.info(f"Session_id {session_id} completed ({reason}), expires in {COMPLETED_SESSION_TTL_DAYS} days")
+    table.update_item(
+        Key={'session_id': session_id, 'agent_name': AGENT_NAME},
+        UpdateExpression='SET session_status = :completed, completion_reason = :reason, completed_at = :completed_at, '
+                         'archive_pending = :date, #ttl = :ttl',
+        ExpressionAttributeNames={'#ttl': 'ttl'},
+        ExpressionAttributeValues={
+            ':completed': 'completed',
+            ':reason': reason,
+            ':completed_at': completed_at,
+            ':date': time.strftime('%Y-%m-%d', time.gmtime(completed_at)),
+            ':ttl': completed_at + COMPLETED_SESSION_TTL_DAYS * 24 * 3600,
+        }
+    )
     return True
 
 def load_from_agent_memory(session_id):
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(MEMORY_TABLE)
+    table = memory_table()
     logger.info(f"Loading messages from {AGENT_NAME} memory for session_id {session_id}")
     # Load messages from agent memory of given session_id for this AGENT_NAME
     response = table.get_item(Key={'session_id': session_id, 'agent_name': AGENT_NAME})
@@ -45,6 +131,23 @@ def load_from_agent_memory(session_id):
     logger.info(f"Loaded {len(messages)} messages from agent memory of {AGENT_NAME} for session_id: {session_id}")
     return messages, parent
 
+def load_checkpoint(session_id, message_id):
+    # Checkpoint of an earlier, interrupted, processing of the same message: its messages, the model tier
+    # that wrote it and the number of messages that tier's run started from
+    if not message_id:
+        return None
+    table = memory_table()
+    response = table.get_item(Key={'session_id': session_id, 'agent_name': AGENT_NAME}, ConsistentRead=True)
+    item = response.get('Item', {})
+    if item.get('checkpoint_of') != message_id:
+        return None
+    logger.info(f"Found checkpoint of message {message_id} with {len(item.get('messages', []))} messages for session_id {session_id}")
+    return {
+        'messages': item.get('messages', []),
+        'tier': item.get('checkpoint_tier'),
+        'start': int(item.get('checkpoint_start', 0)),
+    }
+
 def prepare(task) -> Agent:
     type = task.get('type', None)
     parent = task.get('parent', None)
@@ -74,6 +177,15 @@ def prepare(task) -> Agent:
             session_id = parent.get('session_id', None)
             assert session_id is not None, "Session ID is not specified in parent"
             logger.info(f"Reusing parent session_id: {session_id}")
+        elif task.get('message_id'):
+            # Derive the session_id from the message, so a redelivered message finds its checkpoint
+            session_id = str(uuid.uuid5(uuid.NAMESPACE_URL, task['message_id']))
+            logger.info(f"New session_id: {session_id}")
+            parent = {
+                'agent_name': AGENT_NAME,
+                'session_id': session_id,
+                'callback_sqs': CALLBACK_SQS_URL
+            }
         else:
             # Create a new session_id UUID
             session_id = str(uuid.uuid4())
@@ -108,14 +220,13 @@ def prepare(task) -> Agent:
         # Load messages from agent memory
         messages, parent = load_from_agent_memory(session_id)
         if messages and len(messages) > 1:
-            # Remove the last message from the messages
-            messages = messages[:-1]
-            # Append the tool result to the messages
-            logger.info(f"Appending tool result to messages: {task.get('body', [{}])}")
-            messages.append({
-                "role": "user",
-                "content": task.get('body', [{}])
-            })
+            # Put the tool results in place of the results the async tools returned when dispatched
+            logger.info(f"Splicing tool results into messages: {task.get('body', [{}])}")
+            results = [block['toolResult'] for block in task.get('body', []) if 'toolResult' in block]
+            messages = tool_barrier.splice(messages, results)
+            if messages is None:
+                logger.warning(f"Ignoring tool results that do not belong to the last turn of session_id {session_id}")
+                return session_id, None, None, parent
             return session_id, messages, "Continue", parent
         else:
             logger.info("No messages found in agent memory, starting a new conversation")
@@ -135,59 +246,277 @@ def lambda_handler(event, context):
         }
     
     # Extract the first (and only) message
-    record = json.loads(event['Records'][0]['body'])
-    session_id, history, prompt, parent = prepare(record)
+    sqs_record = event['Records'][0]
+    record = json.loads(sqs_record['body'])
+    # Identity of the task across deferrals and hand-overs, checkpoints are keyed by it
+    record.setdefault('message_id', sqs_record['messageId'])
 
-    system_prompt = """
-    You are a creative social media manager for Unicorn Rentals, a company that offers unicorns for rent that kids and grown-ups can play with.
+    lane = priority_lanes.lane_for(record)
+    priority_lanes.emit_queue_wait(lane, sqs_record, record)
+    if priority_lanes.should_yield(lane):
+        defer(sqs_record, record, priority_lanes.YIELD_SECONDS)
+        return
 
-    Your task is to create engaging social media posts for UniTok, our unicorn-themed social media platform.
-    Before publishing, you must request evaluation of the post to ensure your content adheres to our brand guidelines.
+    session_id = session_ordering.session_key(record)
+    if not session_ordering.ENABLED or session_id is None:
+        delay = process(record, context)
+        if delay is not None:
+            defer(sqs_record, record, delay)
+        return
 
-    Process for creating and publishing posts:
-    1. Generate a creative post based on the user's request
-    2. Request evaluation to check if it meets our brand guidelines
-    3. If the post is REJECTED, revise the post based on feedback and evaluate again
-    4. Once the post is APPROVED, request human approval of the post
-    5. If the human approves the post then publish it to our platform
-    6. If the human denies the post, then restart the process
+    # Ordered mode, the message joins the session inbox and whoever holds the session lock processes it
+    #  Drain request, sent when an invocation handed over a session with messages left in its inbox
+    # {
+    #     'type': 'drain',
+    #     'session_id': 'id of the session'
+    # }
+    if record.get('type') != 'drain':
+        sent_at = sqs_record.get('attributes', {}).get('SentTimestamp', time.time() * 1000)
+        session_ordering.enqueue(session_id, AGENT_NAME, record['message_id'], record.get('enqueued_at', sent_at), record)
+    processed = session_ordering.drain(
+        session_id, AGENT_NAME, context.aws_request_id, lambda task: process(task, context),
+        nudge=lambda delay: rate_limiter.defer(
+            priority_lanes.queue_url('high'), json.dumps({'type': 'drain', 'session_id': session_id}), delay),
+        remaining_ms=context.get_remaining_time_in_millis,
+        dead_letter=lambda body: rate_limiter.defer(DEAD_LETTER_SQS_URL, body, 0) if DEAD_LETTER_SQS_URL else None,
+    )
+    logger.info(f"Processed {processed} messages of session_id {session_id}")
 
-    Important information about Unicorn Rentals:
-    - We offer unicorns in various colors: pink, blue, purple, green, yellow, and rainbow (our most popular)
-    - Our new product feature allows customers to pick their favorite color unicorn to rent
-    - Our target audience includes families with children, fantasy enthusiasts, and event planners
-    - Our brand voice is magical, playful, and family-friendly
+def process(record, context):
+    # Runs the task, returns seconds to wait before retrying when Bedrock had no capacity for it
+    try:
+        run_agent(record, context.get_remaining_time_in_millis)
+    except rate_limiter.CapacityUnavailable as e:
+        # Admission control, hand the message back to SQS instead of waiting for Bedrock capacity
+        return e.delay_seconds
+    except Exception as e:
+        if checkpointing.is_time_budget_exhausted(e):
+            # Progress is checkpointed, a fresh invocation resumes right away
+            logger.info(f"Invocation is about to time out, requeueing message {record.get('message_id')}")
+            return 0
+        if not rate_limiter.is_throttling_error(e):
+            raise
+        logger.warning(f"Bedrock throttled the invocation, deferring the message: {e}")
+        return rate_limiter.throttle_delay()
+    return None
 
-    When creating posts:
-    - Keep content family-friendly and positive
-    - Highlight the magical experience of spending time with unicorns
-    - Mention the new color selection feature when appropriate
-    - Use emojis sparingly but effectively
-    - Keep posts between 50-200 characters for optimal engagement
-    - If your posts are continously being rejected by evaluator and denied by humans then stop after 3 tries
+def defer(sqs_record, record, delay_seconds):
+    # Requeue into the task's lane, keeping the first enqueue time so queue wait metrics span deferrals
+    record.setdefault('enqueued_at', int(sqs_record.get('attributes', {}).get('SentTimestamp', time.time() * 1000)))
+    queue_url = priority_lanes.queue_url(priority_lanes.lane_for(record))
+    rate_limiter.defer(queue_url, json.dumps(record), delay_seconds)
 
-    Always show your thought process when creating posts, evaluating them, and making revisions.
-    """
-    # Create model
-    model = BedrockModel(
-        model_id="us.anthropic.claude-3-7-sonnet-20250219-v1:0",
-        region_name="us-east-1"
-    )
+def schedule_join_timeout(session_id, pending_since, delay_seconds):
+    #  Join timeout, resumes the session with error results for tools that never reported back
+    # {
+    #     'type': 'join_timeout',
+    #     'session_id': 'id of the session',
+    #     'pending_since': 'epoch seconds the session started waiting, identifies the join'
+    # }
+    message_body = {'type': 'join_timeout', 'session_id': session_id, 'pending_since': int(pending_since)}
+    rate_limiter.defer(priority_lanes.queue_url('high'), json.dumps(message_body), delay_seconds)
 
-    # Create agent
-    agent = Agent(
-        system_prompt=system_prompt,
-        model=model,
-        tools=[evaluator_agent, human_approval, publish_post],
-        messages=history,
-    )
-    
-    result = agent(prompt, session_id=session_id, parent=parent)
+def wait_for_tool_results(session_id, messages):
+    # Registers every async tool dispatched in the last turn, the session resumes once all of them reported back
+    tool_use_ids = tool_barrier.outstanding_tool_uses(messages, ASYNC_TOOLS)
+    if not tool_use_ids:
+        return
+    pending_since = tool_barrier.wait_for(session_id, AGENT_NAME, tool_use_ids)
+    if tool_barrier.JOIN_TIMEOUT_SECONDS > 0:
+        schedule_join_timeout(session_id, pending_since, tool_barrier.JOIN_TIMEOUT_SECONDS)
 
-    if result.state.get("stop_event_loop", False):
-        logger.info("Agent needs to wait for tool result. Saving state and sleeping.")
-    save_to_agent_memory(session_id, agent.messages, parent)
+def join_tool_results(task):
+    # Returns the task to resume the session with once all tool results are in, None while still waiting
+    session_id = task.get('session_id', None)
+    assert session_id is not None, "Session ID is not specified"
+    if task['type'] == 'join_timeout':
+        state, value = tool_barrier.expire(session_id, AGENT_NAME, task['pending_since'], task.get('message_id'))
+        if state == 'waiting':
+            # Delays are capped by SQS, check again later
+            schedule_join_timeout(session_id, task['pending_since'], value)
+    else:
+        results = [block['toolResult'] for block in task.get('body', []) if 'toolResult' in block]
+        state, value = tool_barrier.arrive(session_id, AGENT_NAME, results, task.get('message_id'))
+        if state == 'untracked':
+            return task
+    if state != 'ready':
+        logger.info(f"Session_id {session_id} keeps waiting for tool results")
+        return None
+    return dict(task, type='existing', body=[{'toolResult': result} for result in value])
 
-    logger.info(str(result))
+def schedule_speculation(session_id, messages):
+    #  Speculation request, sent when the session starts waiting on a human approval
+    # {
+    #     'type': 'speculate',
+    #     'session_id': 'id of the session',
+    #     'tool_use_id': 'id of the pending human_approval tool use'
+    # }
+    for tool_use_id in tool_barrier.outstanding_tool_uses(messages, ['human_approval']):
+        message_body = {'type': 'speculate', 'session_id': session_id, 'tool_use_id': tool_use_id}
+        rate_limiter.defer(priority_lanes.queue_url('low'), json.dumps(message_body), 0)
 
+def speculate(task):
+    # Writes an alternate candidate for a pending approval and sends it to the evaluator, on the small tier
+    session_id = task['session_id']
+    approval_tool_use_id = task['tool_use_id']
+    if not speculation.reserve(session_id, AGENT_NAME, approval_tool_use_id, task.get('message_id')):
+        return
+    messages, parent = load_from_agent_memory(session_id)
+    tool_uses = [block['toolUse'] for message in messages if message['role'] == 'assistant'
+                 for block in message['content'] if block.get('toolUse', {}).get('toolUseId') == approval_tool_use_id]
+    if not tool_uses:
+        logger.warning(f"Approval {approval_tool_use_id} not found in session_id {session_id}, not speculating")
+        return
+    content = claim_check.resolve(tool_uses[0]['input']['content'])
+    tier = model_router.route(AGENT_NAME, 'speculate')
+    with rate_limiter.lease(model_router.model_id(tier)):
+        # A single model turn without tools, the candidate is evaluated like any other post
+        agent = Agent(system_prompt=SYSTEM_PROMPT, model=model_router.model(tier), tools=[], callback_handler=None,
+                      retry_strategy=None)
+        candidate = str(agent(SPECULATION_PROMPT.format(content=content))).strip()
+    if not speculation.store_candidate(session_id, AGENT_NAME, approval_tool_use_id, candidate):
+        logger.info(f"Approval {approval_tool_use_id} was resolved while speculating, discarding the candidate")
+        return
+    evaluator_agent.request_evaluation(
+        candidate, session_id, parent, speculation.evaluation_tool_use_id(approval_tool_use_id))
 
+def present_speculation(task):
+    # On a denial with an evaluated alternative at hand, hand it to the agent with the denial
+    body = []
+    for block in task.get('body', []):
+        result = block.get('toolResult')
+        slot = speculation.take(task['session_id'], AGENT_NAME, result['toolUseId'], task.get('message_id')) if result else None
+        text = ' '.join(c.get('text', '') for c in result.get('content', [])) if result else ''
+        if slot and 'denied' in text:
+            logger.info(f"Presenting speculative alternative for denied approval {result['toolUseId']}")
+            alternative = (
+                "While this post was waiting for approval, an alternative post was written and evaluated.\n"
+                f"Alternative post:\n{slot['content']}\n"
+                f"Evaluation:\n{slot['evaluation']}\n"
+                "Request human approval of the alternative post right away, it does not need another evaluation."
+            )
+            result = dict(result, content=list(result.get('content', [])) + [{'text': alternative}])
+            block = {'toolResult': result}
+            task = dict(task, speculative=True)
+        body.append(block)
+    return dict(task, body=body)
+
+def step_for(task):
+    # Workflow step of the task, used to pick the model tier
+    if task.get('type') != 'existing':
+        return 'generate'
+    if task.get('speculative'):
+        # The alternative is written and evaluated already, it only needs to go to approval
+        return 'request_approval'
+    results = claim_check.resolve([block['toolResult'] for block in task.get('body', []) if 'toolResult' in block])
+    text = ' '.join(c.get('text', '') for result in results for c in result.get('content', []))
+    if task.get('toolName') == 'human_approval':
+        return 'revise' if 'denied' in text else 'publish'
+    if task.get('toolName') == 'evaluator_agent':
+        return 'revise' if 'REJECTED' in text.upper() else 'request_approval'
+    return 'generate'
+
+def is_published(messages):
+    for message in messages:
+        for block in message.get('content', []):
+            tool_result = block.get('toolResult')
+            if tool_result and tool_result.get('status') == 'success' and 'Post published' in str(tool_result.get('content')):
+                return True
+    return False
+
+def completion_reason(messages):
+    # Why a session that is no longer waiting on any tool has ended
+    if is_published(messages):
+        return 'published'
+    attempts = sum(1 for message in messages for block in message.get('content', [])
+                   if block.get('toolUse', {}).get('name') == 'evaluator_agent')
+    return 'retry_limit' if attempts >= MAX_ATTEMPTS else 'ended'
+
+def is_acceptable(waiting, new_messages):
+    # Output is well-formed when the agent is waiting on an async tool or has published the post
+    return waiting or is_published(new_messages)
+
+def run_agent(record, remaining_ms=None):
+    if record.get('type') == 'speculate':
+        speculate(record)
+        return
+    results = [block['toolResult'] for block in record.get('body', []) if 'toolResult' in block] if record.get('type') == 'existing' else []
+    if results and all(speculation.is_speculative(result['toolUseId']) for result in results):
+        # Evaluation of a speculative candidate, it never resumes the agent
+        for result in results:
+            evaluation = ' '.join(c.get('text', '') for c in claim_check.resolve(result.get('content', [])))
+            speculation.store_evaluation(
+                record['session_id'], AGENT_NAME, speculation.approval_tool_use_id(result['toolUseId']), evaluation)
+        return
+    if record.get('type') in ('existing', 'join_timeout'):
+        record = join_tool_results(record)
+        if record is None:
+            return
+        if speculation.ENABLED:
+            record = present_speculation(record)
+    session_id, history, prompt, parent = prepare(record)
+    message_id = record.get('message_id')
+    checkpoint = load_checkpoint(session_id, message_id)
+    if prompt is None and checkpoint is None:
+        return
+    step = step_for(record)
+    tiers = model_router.escalation_path(model_router.route(AGENT_NAME, step))
+    # Every tier starts from the session history followed by the prompt
+    start = history + [{'role': 'user', 'content': [{'text': prompt}]}] if prompt is not None else history
+    messages, finished = start, False
+
+    if checkpoint is not None:
+        # The checkpoint already holds the prompt, resuming without it keeps the model from repeating the task
+        start = checkpoint['messages'][:checkpoint['start']]
+        messages, finished = checkpointing.resume_point(checkpoint['messages'], ASYNC_TOOLS)
+        if checkpoint['tier'] in tiers:
+            # Continue the escalation at the tier that wrote the checkpoint
+            tiers = tiers[tiers.index(checkpoint['tier']):]
+        logger.info(f"Resuming from checkpoint of tier {checkpoint['tier']} with {len(messages)} messages")
+
+    for tier in tiers:
+        if finished:
+            # The checkpointed run ended before its final save, its output is checked like a fresh one
+            waiting = messages[-1]['role'] != 'assistant'
+        else:
+            model_id = model_router.model_id(tier)
+            with rate_limiter.lease(model_id):
+                # Checkpoint after every model turn and tool result, with the tier and where its run started
+                checkpoint_handler = checkpointing.CheckpointCallbackHandler(
+                    save=lambda checkpointed, tier=tier: save_to_agent_memory(
+                        session_id, checkpointed, parent, checkpoint_of=message_id, tier=tier, start=len(start)),
+                    remaining_ms=remaining_ms
+                )
+                # Create agent with claim-checks resolved for the model
+                agent = Agent(
+                    system_prompt=SYSTEM_PROMPT,
+                    model=model_router.model(tier),
+                    tools=[evaluator_agent, human_approval, publish_post],
+                    messages=claim_check.resolve(messages),
+                    callback_handler=checkpoint_handler,
+                    # No retries in the event loop, throttling reaches the rate limiter and the message is deferred
+                    retry_strategy=None,
+                )
+                checkpoint_handler.agent = agent
+                started = time.perf_counter()
+                result = agent(session_id=session_id, parent=parent)
+                latency_ms = int((time.perf_counter() - started) * 1000)
+            logger.info(f"Model tier {tier} ({model_id}) completed {AGENT_NAME} step `{step}` in {latency_ms} ms")
+            logger.info(str(result))
+            messages = agent.messages
+            waiting = result.state.get("stop_event_loop", False)
+        if tier == tiers[-1] or is_acceptable(waiting, messages[len(start):]):
+            break
+        logger.warning(f"Output of {tier} tier for step `{step}` is not acceptable, escalating")
+        # Every escalation starts over from the same messages
+        messages, finished = start, False
+
+    if waiting:
+        logger.info("Agent needs to wait for tool result. Saving state and sleeping.")
+        # Registered before the final save, a crash in between resumes from the checkpoint and registers again
+        wait_for_tool_results(session_id, messages)
+        if speculation.ENABLED:
+            schedule_speculation(session_id, messages)
+    save_to_agent_memory(session_id, messages, parent)
+    if not waiting:
+        mark_session_completed(session_id, completion_reason(messages))
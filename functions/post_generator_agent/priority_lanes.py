@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import random
+import time
+import aws_clients
+
+# Two lanes feed the post generator agent:
+#   - high: resumptions of existing sessions (tool results, human decisions, join timeouts), one hop away from publishing
+#   - low: brand-new tasks
+# Both queues trigger the agent. A low lane message yields to a non-empty high lane, except for a
+# guaranteed minimum share of low lane messages that are always processed so new work never starves.
+logger = logging.getLogger(__name__)
+
+HIGH_PRIORITY_SQS_URL = os.environ.get('HIGH_PRIORITY_SQS_URL', None)
+LOW_PRIORITY_SQS_URL = os.environ.get('CALLBACK_SQS_URL', None)
+LOW_PRIORITY_MIN_SHARE = float(os.environ.get('LOW_PRIORITY_MIN_SHARE', '0.2'))
+YIELD_SECONDS = int(os.environ.get('LOW_PRIORITY_YIELD_SECONDS', '10'))
+BACKLOG_CACHE_SECONDS = 5
+METRICS_NAMESPACE = 'AsyncAgents'
+HIGH_PRIORITY_TYPES = ['existing', 'drain', 'join_timeout']
+
+_backlog = {'checked_at': 0, 'messages': 0}
+
+
+def lane_for(task):
+    return 'high' if task.get('type') in HIGH_PRIORITY_TYPES else 'low'
+
+
+def queue_url(lane):
+    # Fall back to the single queue setup when no high priority queue is configured
+    if lane == 'high' and HIGH_PRIORITY_SQS_URL:
+        return HIGH_PRIORITY_SQS_URL
+    return LOW_PRIORITY_SQS_URL
+
+
+def high_priority_backlog():
+    # Approximate number of visible high lane messages, cached briefly to keep the check cheap
+    if not HIGH_PRIORITY_SQS_URL:
+        return 0
+    now = time.time()
+    if now - _backlog['checked_at'] > BACKLOG_CACHE_SECONDS:
+        attributes = aws_clients.client('sqs').get_queue_attributes(
+            QueueUrl=HIGH_PRIORITY_SQS_URL,
+            AttributeNames=['ApproximateNumberOfMessages']
+        )['Attributes']
+        _backlog['messages'] = int(attributes['ApproximateNumberOfMessages'])
+        _backlog['checked_at'] = now
+    return _backlog['messages']
+
+
+def should_yield(lane):
+    if lane == 'high' or random.random() < LOW_PRIORITY_MIN_SHARE:
+        return False
+    backlog = high_priority_backlog()
+    if backlog > 0:
+        logger.info(f"Yielding low priority task to {backlog} high priority tasks")
+        return True
+    return False
+
+
+def emit_queue_wait(lane, sqs_record, task):
+    # Time since the task was first enqueued, across deferrals, as a CloudWatch embedded metric
+    enqueued_at = int(task.get('enqueued_at') or sqs_record.get('attributes', {}).get('SentTimestamp', 0))
+    if not enqueued_at:
+        return
+    now = int(time.time() * 1000)
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': now,
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['Lane']],
+                'Metrics': [{'Name': 'QueueWaitTime', 'Unit': 'Milliseconds'}]
+            }]
+        },
+        'Lane': lane,
+        'QueueWaitTime': now - enqueued_at,
+    }))
@@ -0,0 +1,268 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+import aws_clients
+
+# Per-session ordered delivery on top of standard SQS queues.
+# Every message for a session is appended to an inbox item in the memory table,
+# (session_id, '<agent_name>#inbox'), which also carries a lease based lock. Only the lock holder
+# processes the inbox, oldest message first, so messages of one session never run concurrently or
+# out of order while different sessions are processed in parallel by independent invocations.
+# The lock is released only once the inbox is empty, in the same conditional write, so a message
+# appended while the holder is finishing is never stranded.
+# Leases are short and renewed while the holder works through the inbox, so the lock of a holder that
+# died lapses quickly. A message that finds the session locked schedules a drain for when the lease
+# runs out, so the inbox is picked up again even when no other message arrives for the session.
+# Ids of queued messages are kept for DEDUP_SECONDS, longer than SQS keeps redelivering a message, in two
+# generations rotated on release, and an inbox left empty expires through the table's ttl attribute.
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('SESSION_ORDERING', 'enabled') == 'enabled'
+MEMORY_TABLE = os.environ.get('MEMORY_TABLE', 'agent-memory-store')
+MIN_REMAINING_MS = int(os.environ.get('SESSION_ORDERING_MIN_REMAINING_MS', '300000'))
+MAX_ATTEMPTS = int(os.environ.get('SESSION_ORDERING_MAX_ATTEMPTS', '3'))
+RETRY_DELAY_SECONDS = 30
+DEFAULT_REMAINING_MS = 900000
+LEASE_MS = int(os.environ.get('SESSION_ORDERING_LEASE_MS', '60000'))
+# Renewals per lease, a holder survives a missed renewal
+RENEWALS_PER_LEASE = 3
+# Covers every receive of a message, maxReceiveCount times the queue's visibility timeout
+DEDUP_SECONDS = int(os.environ.get('SESSION_ORDERING_DEDUP_SECONDS', '3600'))
+
+# Locks this process holds while processing a message, (session_id, agent_name): owner, kept alive by one renewer thread
+_held = {}
+_held_lock = threading.Lock()
+_renewer = []
+
+
+def _table():
+    return aws_clients.table(MEMORY_TABLE)
+
+
+def _key(session_id, agent_name):
+    return {'session_id': session_id, 'agent_name': f"{agent_name}#inbox"}
+
+
+def session_key(task):
+    # Session a task belongs to, None for brand-new sessions which need no ordering and for speculation,
+    # which never resumes the agent and only writes the speculative slot conditionally
+    if task.get('type') == 'speculate':
+        return None
+    return task.get('session_id') or (task.get('parent') or {}).get('session_id')
+
+
+def enqueue(session_id, agent_name, message_id, sent_at, task):
+    # Append to the inbox, redelivered SQS messages are recognised by message_id and not appended twice
+    appended = aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET pending = list_append(if_not_exists(pending, :empty), :entry), '
+                         'message_ids_since = if_not_exists(message_ids_since, :now) ADD message_ids :ids REMOVE #ttl',
+        ConditionExpression='(attribute_not_exists(message_ids) OR NOT contains(message_ids, :id)) AND '
+                            '(attribute_not_exists(previous_message_ids) OR NOT contains(previous_message_ids, :id))',
+        ExpressionAttributeNames={'#ttl': 'ttl'},
+        ExpressionAttributeValues={
+            ':empty': [],
+            ':entry': [{'message_id': message_id, 'sent_at': int(sent_at), 'body': json.dumps(task), 'attempts': 0}],
+            ':now': int(time.time()),
+            ':ids': {message_id},
+            ':id': message_id,
+        }
+    )
+    logger.info(f"{'Queued' if appended else 'Already queued'} message {message_id} in inbox of session_id {session_id}")
+
+
+def try_lock(session_id, agent_name, owner, lease_ms):
+    now = int(time.time() * 1000)
+    return aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET lock_owner = :owner, lock_expires = :expires',
+        ConditionExpression='attribute_not_exists(lock_owner) OR lock_expires < :now OR lock_owner = :owner',
+        ExpressionAttributeValues={':owner': owner, ':expires': now + lease_ms, ':now': now}
+    )
+
+
+def renew(session_id, agent_name, owner):
+    # Extends the lease of a lock the owner still holds
+    return aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET lock_expires = :expires',
+        ConditionExpression='lock_owner = :owner',
+        ExpressionAttributeValues={':owner': owner, ':expires': int(time.time() * 1000) + LEASE_MS}
+    )
+
+
+def _renew_held():
+    while True:
+        time.sleep(LEASE_MS / RENEWALS_PER_LEASE / 1000)
+        with _held_lock:
+            held = list(_held.items())
+        for (session_id, agent_name), owner in held:
+            try:
+                if not renew(session_id, agent_name, owner):
+                    logger.warning(f"Lost the lock of session_id {session_id}")
+            except Exception as e:
+                logger.warning(f"Renewing the lock of session_id {session_id} failed: {e}")
+
+
+@contextmanager
+def holding(session_id, agent_name, owner):
+    # Keeps renewing the lease while a message is processed, it lapses soon after the process dies
+    with _held_lock:
+        _held[(session_id, agent_name)] = owner
+        if not _renewer:
+            _renewer.append(threading.Thread(target=_renew_held, name='session-lock-renewer', daemon=True))
+            _renewer[0].start()
+    try:
+        yield
+    finally:
+        with _held_lock:
+            _held.pop((session_id, agent_name), None)
+
+
+def schedule_drain(session_id, agent_name, nudge):
+    # The session is locked, make sure a drain runs once the lease runs out in case the holder died.
+    # One drain is scheduled at a time, the drain reschedules itself while the holder keeps renewing.
+    now = int(time.time() * 1000)
+    item = _table().get_item(Key=_key(session_id, agent_name), ConsistentRead=True).get('Item', {})
+    drain_at = max(now, int(item.get('lock_expires', now))) + 1000
+    scheduled = aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET drain_at = :drain_at',
+        ConditionExpression='attribute_not_exists(drain_at) OR drain_at <= :now',
+        ExpressionAttributeValues={':drain_at': drain_at, ':now': now}
+    )
+    if scheduled:
+        nudge(math.ceil((drain_at - now) / 1000))
+
+
+def next_pending(session_id, agent_name):
+    # Oldest pending message and its position in the inbox, positions are stable while we hold the lock
+    item = _table().get_item(Key=_key(session_id, agent_name), ConsistentRead=True).get('Item', {})
+    pending = item.get('pending', [])
+    if not pending:
+        return None, None
+    index = min(range(len(pending)), key=lambda i: (int(pending[i]['sent_at']), i))
+    return index, pending[index]
+
+
+def remove(session_id, agent_name, owner, index):
+    aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression=f'REMOVE pending[{index}]',
+        ConditionExpression='lock_owner = :owner',
+        ExpressionAttributeValues={':owner': owner}
+    )
+
+
+def record_attempt(session_id, agent_name, owner, index):
+    aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression=f'SET pending[{index}].attempts = pending[{index}].attempts + :one',
+        ConditionExpression='lock_owner = :owner',
+        ExpressionAttributeValues={':owner': owner, ':one': 1}
+    )
+
+
+def forget_message_ids(session_id, agent_name):
+    # Moves message ids to the previous generation once the current one is DEDUP_SECONDS old, dropping the
+    # previous generation, so every id is kept at least DEDUP_SECONDS and message_ids stays bounded
+    now = int(time.time())
+    aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET previous_message_ids = message_ids, message_ids_since = :now REMOVE message_ids',
+        ConditionExpression='attribute_exists(message_ids) AND '
+                            '(attribute_not_exists(message_ids_since) OR message_ids_since < :cutoff)',
+        ExpressionAttributeValues={':now': now, ':cutoff': now - DEDUP_SECONDS}
+    )
+
+
+def release(session_id, agent_name, owner, force=False):
+    # Without force the lock is only released once the inbox is empty, the empty inbox then expires
+    # once redeliveries of its messages are no longer possible, unless a new message arrives first
+    if force:
+        return aws_clients.conditional(
+            _table().update_item,
+            Key=_key(session_id, agent_name),
+            UpdateExpression='REMOVE lock_owner, lock_expires',
+            ConditionExpression='lock_owner = :owner',
+            ExpressionAttributeValues={':owner': owner}
+        )
+    released = aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET #ttl = :ttl REMOVE lock_owner, lock_expires, drain_at',
+        ConditionExpression='lock_owner = :owner AND (attribute_not_exists(pending) OR size(pending) = :zero)',
+        ExpressionAttributeNames={'#ttl': 'ttl'},
+        ExpressionAttributeValues={':owner': owner, ':zero': 0, ':ttl': int(time.time()) + DEDUP_SECONDS}
+    )
+    if released:
+        forget_message_ids(session_id, agent_name)
+    return released
+
+
+def drain(session_id, agent_name, owner, process, nudge, remaining_ms=None, dead_letter=None):
+    """
+    Process the inbox of a session in order while holding its lock.
+
+    Parameters:
+    process (callable): runs one task, returns None when done or seconds to wait when it has to be retried later
+    nudge (callable): schedules another drain of the session after the given number of seconds, also used when
+        the session is locked so its inbox is drained once the lease runs out
+    remaining_ms (callable): remaining time of the invocation, drain hands over once it gets low
+    dead_letter (callable): receives tasks that failed MAX_ATTEMPTS times
+
+    Returns:
+    int: number of messages processed
+    """
+    remaining_ms = remaining_ms or (lambda: DEFAULT_REMAINING_MS)
+    if not try_lock(session_id, agent_name, owner, LEASE_MS):
+        logger.info(f"Session_id {session_id} is being processed by another invocation, message stays queued")
+        schedule_drain(session_id, agent_name, nudge)
+        return 0
+    processed = 0
+    while True:
+        index, entry = next_pending(session_id, agent_name)
+        if entry is None:
+            if release(session_id, agent_name, owner):
+                return processed
+            continue
+        if remaining_ms() < MIN_REMAINING_MS:
+            logger.info(f"Running out of time, handing session_id {session_id} over to a new invocation")
+            release(session_id, agent_name, owner, force=True)
+            nudge(0)
+            return processed
+        # Renewed per message, and in the background while the message is processed
+        if not renew(session_id, agent_name, owner):
+            logger.warning(f"Lost the lock of session_id {session_id}, leaving its inbox to the new holder")
+            return processed
+        try:
+            with holding(session_id, agent_name, owner):
+                delay = process(json.loads(entry['body']))
+        except Exception as e:
+            logger.exception(f"Processing message {entry['message_id']} of session_id {session_id} failed: {e}")
+            if int(entry.get('attempts', 0)) + 1 >= MAX_ATTEMPTS:
+                # Poison message, park it so the rest of the session can make progress
+                if dead_letter:
+                    dead_letter(entry['body'])
+                remove(session_id, agent_name, owner, index)
+                continue
+            record_attempt(session_id, agent_name, owner, index)
+            delay = RETRY_DELAY_SECONDS
+        if delay is not None:
+            # Keep the message at the head of the inbox and come back later
+            release(session_id, agent_name, owner, force=True)
+            nudge(delay)
+            return processed
+        remove(session_id, agent_name, owner, index)
+        processed += 1
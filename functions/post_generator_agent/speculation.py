@@ -0,0 +1,123 @@
+import logging
+import os
+import aws_clients
+import claim_check
+
+# Speculative revision while a post waits for human approval. When the agent stops on human_approval,
+# a low priority 'speculate' task writes one alternate candidate on the small tier and sends it to the
+# evaluator. Candidate and evaluation are kept in the `speculative` slot of the session's memory item,
+# tied to the toolUseId of the pending approval. A denial resumes the agent with the evaluated
+# alternative at hand so it can go straight back to human approval. The message resolving the approval
+# marks the slot taken, any speculative work still in flight finds it taken and stops, and a redelivery
+# of that message, e.g. after a deferral, is handed the same slot again. The next reservation replaces it.
+# Cost is capped to one candidate per approval request and MAX_PER_SESSION candidates per session.
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('SPECULATIVE_REVISION', 'disabled') == 'enabled'
+MEMORY_TABLE = os.environ.get('MEMORY_TABLE', 'agent-memory-store')
+MAX_PER_SESSION = int(os.environ.get('SPECULATION_MAX_PER_SESSION', '2'))
+# Evaluations of candidates are requested with this prefix on the approval's toolUseId
+TOOL_USE_PREFIX = 'speculative-'
+
+
+def _table():
+    return aws_clients.table(MEMORY_TABLE)
+
+
+def _key(session_id, agent_name):
+    return {'session_id': session_id, 'agent_name': agent_name}
+
+
+def is_speculative(tool_use_id):
+    return tool_use_id.startswith(TOOL_USE_PREFIX)
+
+
+def evaluation_tool_use_id(approval_tool_use_id):
+    return f"{TOOL_USE_PREFIX}{approval_tool_use_id}"
+
+
+def approval_tool_use_id(tool_use_id):
+    return tool_use_id[len(TOOL_USE_PREFIX):]
+
+
+def reserve(session_id, agent_name, approval_tool_use_id, message_id):
+    """
+    Claim the speculative slot for a pending approval, within the per session cap
+
+    Returns:
+    bool: True when the caller should generate a candidate
+    """
+    item = _table().get_item(Key=_key(session_id, agent_name), ConsistentRead=True).get('Item', {})
+    slot = item.get('speculative')
+    if slot and slot['for_tool_use_id'] == approval_tool_use_id:
+        # Redelivery of the task that reserved the slot, the candidate is not written yet
+        return slot.get('message_id') == message_id and slot['status'] == 'generating' and 'taken_by' not in slot
+    reserved = aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET speculative = :slot ADD speculations :one',
+        ConditionExpression='contains(pending_tool_use_ids, :id) '
+                            'AND (attribute_not_exists(speculations) OR speculations < :max)',
+        ExpressionAttributeValues={
+            ':slot': {'for_tool_use_id': approval_tool_use_id, 'message_id': message_id, 'status': 'generating'},
+            ':one': 1,
+            ':id': approval_tool_use_id,
+            ':max': MAX_PER_SESSION,
+        }
+    )
+    if reserved is None:
+        logger.info(f"No speculation for session_id {session_id}, approval resolved or cap of {MAX_PER_SESSION} reached")
+    return reserved is not None
+
+
+def _update_slot(session_id, agent_name, approval_tool_use_id, update, values):
+    values = dict(values, **{':id': approval_tool_use_id})
+    return aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression=update,
+        ConditionExpression='speculative.for_tool_use_id = :id AND attribute_not_exists(speculative.taken_by)',
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues=values
+    ) is not None
+
+
+def store_candidate(session_id, agent_name, approval_tool_use_id, content):
+    # False when the approval was resolved meanwhile, the candidate is then not evaluated
+    return _update_slot(session_id, agent_name, approval_tool_use_id,
+                        'SET speculative.content = :content, speculative.#status = :status',
+                        {':content': claim_check.offload(content), ':status': 'evaluating'})
+
+
+def store_evaluation(session_id, agent_name, approval_tool_use_id, evaluation):
+    approved = 'APPROVED' in evaluation.upper() and 'REJECTED' not in evaluation.upper()
+    stored = _update_slot(session_id, agent_name, approval_tool_use_id,
+                          'SET speculative.evaluation = :evaluation, speculative.#status = :status',
+                          {':evaluation': claim_check.offload(evaluation), ':status': 'ready' if approved else 'rejected'})
+    logger.info(f"Speculative candidate of session_id {session_id} {'approved' if approved else 'rejected'} by the evaluator"
+                f"{'' if stored else ', approval already resolved, discarded'}")
+    return stored
+
+
+def take(session_id, agent_name, approval_tool_use_id, message_id):
+    """
+    Mark the speculative slot of a resolved approval taken by the message resolving it, a redelivery of
+    that message takes it again
+
+    Returns:
+    dict: the slot when it holds an evaluated and approved candidate, None otherwise
+    """
+    response = aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET speculative.taken_by = :message_id',
+        ConditionExpression='speculative.for_tool_use_id = :id AND '
+                            '(attribute_not_exists(speculative.taken_by) OR speculative.taken_by = :message_id)',
+        ExpressionAttributeValues={':id': approval_tool_use_id, ':message_id': message_id},
+        ReturnValues='ALL_NEW'
+    )
+    if response is None:
+        return None
+    slot = response['Attributes']['speculative']
+    logger.info(f"Took speculative slot of session_id {session_id} in status {slot['status']}")
+    return claim_check.resolve(slot) if slot['status'] == 'ready' else None
@@ -0,0 +1,177 @@
+import logging
+import os
+import time
+import aws_clients
+
+# Join barrier for async tools. A single agent turn may dispatch several long-running tools
+# (e.g. two evaluations, or an evaluation and a human approval). When the agent stops, the set of
+# outstanding toolUseIds is recorded on the session's memory item. Arriving results are buffered in
+# the same item and the agent resumes only once all of them arrived, or once the join timed out.
+# Whoever completes the set claims it with a conditional write, so the agent resumes exactly once;
+# the claim is remembered so a redelivery of the claiming message resumes with the same results.
+logger = logging.getLogger(__name__)
+
+MEMORY_TABLE = os.environ.get('MEMORY_TABLE', 'agent-memory-store')
+JOIN_TIMEOUT_SECONDS = int(os.environ.get('JOIN_TIMEOUT_SECONDS', '0'))
+
+
+def _table():
+    return aws_clients.table(MEMORY_TABLE)
+
+
+def _key(session_id, agent_name):
+    return {'session_id': session_id, 'agent_name': agent_name}
+
+
+def outstanding_tool_uses(messages, async_tools):
+    # toolUseIds of async tools dispatched in the last assistant turn
+    for message in reversed(messages):
+        if message['role'] == 'assistant':
+            return [block['toolUse']['toolUseId'] for block in message['content']
+                    if 'toolUse' in block and block['toolUse']['name'] in async_tools]
+    return []
+
+
+def wait_for(session_id, agent_name, tool_use_ids):
+    """
+    Record the set of toolUseIds the session waits for
+
+    Returns:
+    int: epoch seconds the wait started at, identifies this round of the barrier
+    """
+    since = int(time.time())
+    _table().update_item(
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET pending_tool_use_ids = :ids, pending_since = :since, '
+                         'buffered_results = if_not_exists(buffered_results, :empty) '
+                         'REMOVE joined_results, joined_by',
+        ExpressionAttributeValues={':ids': list(tool_use_ids), ':since': since, ':empty': {}}
+    )
+    logger.info(f"Session_id {session_id} waits for {len(tool_use_ids)} tool results: {tool_use_ids}")
+    return since
+
+
+def _claim(session_id, agent_name, item, results, message_id):
+    # Only one arrival resumes the agent, the condition fails for everyone after the first claim
+    return aws_clients.conditional(
+        _table().update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression='SET joined_results = :results, joined_by = :message_id '
+                         'REMOVE pending_tool_use_ids, pending_since, buffered_results',
+        ConditionExpression='pending_since = :since',
+        ExpressionAttributeValues={':results': results, ':message_id': message_id, ':since': item['pending_since']}
+    ) is not None
+
+
+def _ordered(item, results):
+    return [results[tool_use_id] for tool_use_id in item['pending_tool_use_ids'] if tool_use_id in results]
+
+
+def arrive(session_id, agent_name, tool_results, message_id):
+    """
+    Buffer arriving tool results
+
+    Returns:
+    tuple: (state, results) with state
+        'ready' and every joined toolResult when the barrier is complete,
+        'waiting' when other results are still outstanding,
+        'untracked' when the session does not wait on a barrier
+    """
+    table = _table()
+    item = table.get_item(Key=_key(session_id, agent_name), ConsistentRead=True).get('Item', {})
+    if item.get('joined_by') == message_id:
+        # Redelivery of the message that completed the barrier
+        return 'ready', item['joined_results']
+    if 'pending_tool_use_ids' not in item:
+        joined = {r['toolUseId'] for r in item.get('joined_results', [])}
+        if any(r['toolUseId'] in joined for r in tool_results):
+            logger.info(f"Dropping duplicate tool results for session_id {session_id}")
+            return 'waiting', None
+        return 'untracked', tool_results
+
+    pending = set(item['pending_tool_use_ids'])
+    arriving = {r['toolUseId']: r for r in tool_results if r['toolUseId'] in pending}
+    if len(arriving) < len(tool_results):
+        logger.info(f"Dropping stale tool results for session_id {session_id}")
+    if not arriving:
+        return 'waiting', None
+    update = 'SET ' + ', '.join(f'buffered_results.#id{i} = :result{i}' for i in range(len(arriving)))
+    names = {f'#id{i}': tool_use_id for i, tool_use_id in enumerate(arriving)}
+    values = {f':result{i}': result for i, result in enumerate(arriving.values())}
+    values[':since'] = item['pending_since']
+    response = aws_clients.conditional(
+        table.update_item,
+        Key=_key(session_id, agent_name),
+        UpdateExpression=update,
+        ConditionExpression='pending_since = :since',
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    if response is None:
+        # The barrier was completed or timed out in the meantime
+        return 'waiting', None
+    item = response['Attributes']
+    buffered = item.get('buffered_results', {})
+    missing = pending - set(buffered)
+    if missing:
+        logger.info(f"Session_id {session_id} still waits for {len(missing)} tool results")
+        return 'waiting', None
+    results = _ordered(item, buffered)
+    if not _claim(session_id, agent_name, item, results, message_id):
+        return 'waiting', None
+    return 'ready', results
+
+
+def expire(session_id, agent_name, since, message_id):
+    """
+    Complete the barrier of the given round once it timed out, missing results become errors
+
+    Returns:
+    tuple: (state, value) with state 'ready' and the joined toolResults, 'waiting' and the seconds
+    left until the timeout, or 'done' when the round has already been completed
+    """
+    item = _table().get_item(Key=_key(session_id, agent_name), ConsistentRead=True).get('Item', {})
+    if item.get('joined_by') == message_id:
+        return 'ready', item['joined_results']
+    if int(item.get('pending_since', -1)) != int(since):
+        return 'done', None
+    left = int(since) + JOIN_TIMEOUT_SECONDS - int(time.time())
+    if left > 0:
+        return 'waiting', left
+    buffered = dict(item.get('buffered_results', {}))
+    for tool_use_id in item['pending_tool_use_ids']:
+        if tool_use_id not in buffered:
+            logger.warning(f"Tool result {tool_use_id} of session_id {session_id} timed out")
+            buffered[tool_use_id] = {
+                'toolUseId': tool_use_id,
+                'status': 'error',
+                'content': [{'text': f"No result arrived within {JOIN_TIMEOUT_SECONDS} seconds"}]
+            }
+    results = _ordered(item, buffered)
+    if not _claim(session_id, agent_name, item, results, message_id):
+        return 'done', None
+    return 'ready', results
+
+
+def splice(messages, tool_results):
+    """
+    Put tool results in place of the placeholder results the async tools returned when dispatched
+
+    Returns:
+    list: messages ending with a user message holding every toolResult of the last assistant turn,
+    or None when none of the results belongs to the last assistant turn
+    """
+    results = {r['toolUseId']: r for r in tool_results}
+    last = messages[-1]
+    if last['role'] == 'user' and any('toolResult' in block for block in last['content']):
+        if not any(block.get('toolResult', {}).get('toolUseId') in results for block in last['content']):
+            return None
+        content = [
+            {'toolResult': results[block['toolResult']['toolUseId']]}
+            if block.get('toolResult', {}).get('toolUseId') in results else block
+            for block in last['content']
+        ]
+        return messages[:-1] + [{'role': 'user', 'content': content}]
+    # Conversation stopped before the placeholder results were recorded
+    return messages + [{'role': 'user', 'content': [{'toolResult': r} for r in results.values()]}]
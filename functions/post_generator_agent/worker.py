@@ -0,0 +1,191 @@
+# Long-lived worker running the agent outside Lambda, e.g. as a container service for steady high volume.
+# Long-polls the agent's queues and hands every message to the unchanged `index.lambda_handler`, so task
+# preparation, memory, ordering, checkpointing and deferrals behave exactly as in Lambda. One asyncio
+# event loop polls, extends the visibility of in-flight messages and deletes finished ones, while at most
+# WORKER_CONCURRENCY agent runs execute on a thread pool, the agent loop and the AWS SDK being blocking.
+# Every queue has its own poller, which asks for as many messages as there are free slots. Slots are only
+# taken once messages arrive, so the long-poll of an idle queue does not keep the others from using them.
+# Model clients, memory tables and SQS clients are created once and reused across tasks.
+#
+# On SIGTERM or SIGINT the worker stops polling and gives in-flight runs WORKER_SHUTDOWN_SECONDS to finish.
+# Their remaining time shrinks to that deadline, so agent loops stop at their next checkpoint and requeue
+# themselves. Messages that still did not finish become visible again once heartbeats stop.
+#
+# Usage, from the agent's directory with the same environment variables as the Lambda function:
+#   python worker.py
+# WORKER_QUEUE_URLS lists the queues to poll, comma separated, by default HIGH_PRIORITY_SQS_URL and
+# CALLBACK_SQS_URL, i.e. both lanes of the post generator or the evaluator's own queue.
+import asyncio
+import logging
+import math
+import os
+import signal
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '8'))
+# Agent runs share one Bedrock client per model tier, size its pool to the concurrency
+os.environ.setdefault('BEDROCK_MAX_POOL_CONNECTIONS', str(CONCURRENCY + 2))
+
+import boto3
+from botocore.config import Config
+import index
+
+logger = logging.getLogger(__name__)
+
+QUEUE_URLS = [url for url in os.environ.get(
+    'WORKER_QUEUE_URLS',
+    ','.join(filter(None, [os.environ.get('HIGH_PRIORITY_SQS_URL'), os.environ.get('CALLBACK_SQS_URL')]))
+).split(',') if url]
+# Same budget as the Lambda function timeout, checkpointing and session ordering hand over before it ends
+TASK_SECONDS = int(os.environ.get('WORKER_TASK_SECONDS', '900'))
+SHUTDOWN_SECONDS = int(os.environ.get('WORKER_SHUTDOWN_SECONDS', '90'))
+# In-flight messages are kept invisible in steps of VISIBILITY_SECONDS, renewed every HEARTBEAT_SECONDS
+VISIBILITY_SECONDS = int(os.environ.get('WORKER_VISIBILITY_SECONDS', '120'))
+HEARTBEAT_SECONDS = int(os.environ.get('WORKER_HEARTBEAT_SECONDS', '40'))
+WAIT_TIME_SECONDS = 20
+MAX_MESSAGES = 10
+RECEIVE_ERROR_BACKOFF_SECONDS = 5
+
+
+class WorkerContext:
+    # Stands in for the Lambda context, the handlers use the request id and the remaining time
+    def __init__(self, deadline):
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = deadline
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline() - time.monotonic()) * 1000))
+
+
+def lambda_record(queue_url, message):
+    # SQS message in the shape of a Lambda event source record
+    return {
+        'messageId': message['MessageId'],
+        'receiptHandle': message['ReceiptHandle'],
+        'body': message['Body'],
+        'attributes': message.get('Attributes', {}),
+        'messageAttributes': message.get('MessageAttributes', {}),
+        'eventSource': 'aws:sqs',
+        'eventSourceARN': queue_url,
+    }
+
+
+class Worker:
+    def __init__(self, handler, queue_urls, concurrency):
+        self.handler = handler
+        self.queue_urls = queue_urls
+        self.concurrency = concurrency
+        self.slots = asyncio.Semaphore(concurrency)
+        # Messages received and not finished, pollers ask for more only while it is below the concurrency
+        self.received = 0
+        self.capacity = asyncio.Condition()
+        # Agent runs and SQS calls get separate pools, heartbeats must not wait behind agent runs
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='agent')
+        self.io = ThreadPoolExecutor(max_workers=len(queue_urls) + 4, thread_name_prefix='sqs')
+        # Built once up front on its own session, clients are thread safe once created
+        self.sqs = boto3.session.Session().client('sqs', config=Config(max_pool_connections=len(queue_urls) + 4))
+        self.stopping = asyncio.Event()
+        self.shutdown_deadline = math.inf
+        self.tasks = set()
+
+    async def _call(self, method, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.io, lambda: method(**kwargs))
+
+    async def poll(self, queue_url):
+        while not self.stopping.is_set():
+            async with self.capacity:
+                await self.capacity.wait_for(lambda: self.received < self.concurrency)
+            # Pollers of other queues may receive messages meanwhile, these then wait briefly for a slot
+            wanted = min(MAX_MESSAGES, self.concurrency - self.received)
+            try:
+                messages = (await self._call(
+                    self.sqs.receive_message,
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=wanted,
+                    WaitTimeSeconds=WAIT_TIME_SECONDS,
+                    VisibilityTimeout=VISIBILITY_SECONDS,
+                    AttributeNames=['All'],
+                    MessageAttributeNames=['All']
+                )).get('Messages', [])
+            except Exception as e:
+                logger.exception(f"Receiving from {queue_url} failed: {e}")
+                messages = []
+                await asyncio.sleep(RECEIVE_ERROR_BACKOFF_SECONDS)
+            self.received += len(messages)
+            for message in messages:
+                task = asyncio.create_task(self.handle(queue_url, message))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def heartbeat(self, queue_url, message):
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await self._call(
+                    self.sqs.change_message_visibility,
+                    QueueUrl=queue_url,
+                    ReceiptHandle=message['ReceiptHandle'],
+                    VisibilityTimeout=VISIBILITY_SECONDS
+                )
+            except Exception as e:
+                logger.warning(f"Extending visibility of message {message['MessageId']} failed: {e}")
+
+    async def handle(self, queue_url, message):
+        # The message stays invisible while it waits for a slot and while it runs
+        heartbeat = asyncio.create_task(self.heartbeat(queue_url, message))
+        try:
+            async with self.slots:
+                await self.run_handler(queue_url, message)
+        finally:
+            heartbeat.cancel()
+            async with self.capacity:
+                self.received -= 1
+                self.capacity.notify_all()
+
+    async def run_handler(self, queue_url, message):
+        started = time.monotonic()
+        context = WorkerContext(lambda: min(started + TASK_SECONDS, self.shutdown_deadline))
+        event = {'Records': [lambda_record(queue_url, message)]}
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.handler, event, context)
+            await self._call(self.sqs.delete_message, QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+            logger.info(f"Processed message {message['MessageId']} in {time.monotonic() - started:.1f} s")
+        except Exception as e:
+            # Like a failed Lambda invocation, the message is retried once its visibility times out
+            logger.exception(f"Processing message {message['MessageId']} failed: {e}")
+
+    def stop(self):
+        if self.stopping.is_set():
+            return
+        logger.info(f"Shutting down, {len(self.tasks)} messages in flight get {SHUTDOWN_SECONDS} s to finish")
+        self.shutdown_deadline = time.monotonic() + SHUTDOWN_SECONDS
+        self.stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+        logger.info(f"Polling {self.queue_urls} with concurrency {self.concurrency}")
+        pollers = [asyncio.create_task(self.poll(url)) for url in self.queue_urls]
+        await self.stopping.wait()
+        for poller in pollers:
+            poller.cancel()
+        if self.tasks:
+            # Runs cannot be cancelled, their remaining time is already running out
+            done, pending = await asyncio.wait(set(self.tasks), timeout=SHUTDOWN_SECONDS + HEARTBEAT_SECONDS)
+            if pending:
+                logger.warning(f"{len(pending)} messages did not finish, they are redelivered after their visibility timeout")
+        self.io.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(threadName)s %(name)s %(message)s')
+    assert QUEUE_URLS, "No queues to poll, set WORKER_QUEUE_URLS"
+    asyncio.run(Worker(index.lambda_handler, QUEUE_URLS, CONCURRENCY).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Lambda function that moves completed agent sessions out of the hot memory table
+# Scheduled runs export completed sessions in bulk into gzip compressed JSON lines files, partitioned
+# by completion date, next to a manifest of the sessions each file holds. The sessions then expire
+# from the memory table through their `ttl`. Archived sessions can be rehydrated on demand.
+# Sessions waiting for export are read from the sparse `archive-pending` index, keyed by the completion
+# date the agents set in `archive_pending`, which is removed once the session is archived.
+import base64
+import gzip
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MEMORY_TABLE = os.environ.get('MEMORY_TABLE', 'agent-memory-store')
+ARCHIVE_PENDING_INDEX = 'archive-pending'
+# Completed sessions expire after this many days, older completion dates hold nothing left to archive
+COMPLETED_SESSION_TTL_DAYS = int(os.environ.get('COMPLETED_SESSION_TTL_DAYS', '7'))
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', None)
+ARCHIVE_PREFIX = 'sessions/'
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+REHYDRATED_SESSION_TTL_DAYS = int(os.environ.get('REHYDRATED_SESSION_TTL_DAYS', '7'))
+
+dynamodb = boto3.client('dynamodb')
+s3 = boto3.client('s3')
+
+
+def _encode(value):
+    # Items are kept in DynamoDB JSON, binary attributes are base64 encoded like in DynamoDB exports
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"Cannot archive value of type {type(value)}")
+
+
+def _decode(attribute):
+    # Reverse of _encode for a single DynamoDB JSON attribute value
+    (type_, value), = attribute.items()
+    if type_ == 'B':
+        return {'B': base64.b64decode(value)}
+    if type_ == 'BS':
+        return {'BS': [base64.b64decode(v) for v in value]}
+    if type_ == 'M':
+        return {'M': {k: _decode(v) for k, v in value.items()}}
+    if type_ == 'L':
+        return {'L': [_decode(v) for v in value]}
+    return attribute
+
+
+def completed_sessions():
+    # Completed, not yet archived, sessions of all agents, oldest completion date first
+    today = datetime.now(timezone.utc).date()
+    paginator = dynamodb.get_paginator('query')
+    for days_ago in range(COMPLETED_SESSION_TTL_DAYS + 1, -1, -1):
+        for page in paginator.paginate(
+            TableName=MEMORY_TABLE,
+            IndexName=ARCHIVE_PENDING_INDEX,
+            KeyConditionExpression='archive_pending = :date',
+            ExpressionAttributeValues={':date': {'S': (today - timedelta(days=days_ago)).isoformat()}}
+        ):
+            yield from page.get('Items', [])
+
+
+def write_partition(date, items):
+    """
+    Write one archive file and its manifest for sessions completed on the given date
+
+    Returns:
+    str: S3 key of the archive file
+    """
+    part = f"{ARCHIVE_PREFIX}dt={date}/part-{datetime.now(timezone.utc):%H%M%S}-{uuid.uuid4().hex[:8]}"
+    lines = '\n'.join(json.dumps({'Item': item}, default=_encode) for item in items)
+    s3.put_object(
+        Bucket=ARCHIVE_BUCKET,
+        Key=f"{part}.jsonl.gz",
+        Body=gzip.compress(lines.encode('utf-8')),
+        ContentType='application/json',
+        ContentEncoding='gzip'
+    )
+    manifest = [{'session_id': item['session_id']['S'], 'agent_name': item['agent_name']['S']} for item in items]
+    s3.put_object(Bucket=ARCHIVE_BUCKET, Key=f"{part}.manifest.json", Body=json.dumps(manifest))
+    for item in items:
+        try:
+            dynamodb.update_item(
+                TableName=MEMORY_TABLE,
+                Key={'session_id': item['session_id'], 'agent_name': item['agent_name']},
+                UpdateExpression='SET archived_at = :now, archive_key = :key REMOVE archive_pending',
+                ConditionExpression='attribute_exists(archive_pending)',
+                ExpressionAttributeValues={
+                    ':now': {'N': str(int(datetime.now(timezone.utc).timestamp()))},
+                    ':key': {'S': f"{part}.jsonl.gz"}
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Expired through its ttl since the index was read, or archived already by a stale index read
+            logger.info(f"Session_id {item['session_id']['S']} of {item['agent_name']['S']} is gone or archived, skipping")
+    logger.info(f"Archived {len(items)} sessions to s3://{ARCHIVE_BUCKET}/{part}.jsonl.gz")
+    return f"{part}.jsonl.gz"
+
+
+def export_completed_sessions():
+    assert ARCHIVE_BUCKET is not None, "ARCHIVE_BUCKET is not specified"
+    partitions = {}
+    files = []
+    archived = 0
+    for item in completed_sessions():
+        completed_at = int(item.get('completed_at', {}).get('N', '0'))
+        date = datetime.fromtimestamp(completed_at, timezone.utc).strftime('%Y-%m-%d')
+        partitions.setdefault(date, []).append(item)
+        if len(partitions[date]) >= ARCHIVE_BATCH_SIZE:
+            files.append(write_partition(date, partitions.pop(date)))
+            archived += ARCHIVE_BATCH_SIZE
+    for date, items in partitions.items():
+        files.append(write_partition(date, items))
+        archived += len(items)
+    return {'archived': archived, 'files': files}
+
+
+def belongs_to(key, session_id):
+    # Evaluator sessions of a post are keyed <session_id>#<toolUseId> of the evaluation request
+    return key == session_id or key.startswith(f"{session_id}#")
+
+
+def find_archived_session(session_id, completed_date=None):
+    """
+    Load the archived items of a session and of its evaluator sessions, newest archive first
+
+    Parameters:
+    session_id (str): id of the session
+    completed_date (str): YYYY-MM-DD completion date, narrows the search to one partition
+
+    Returns:
+    list: items of the session in DynamoDB JSON, one per agent and evaluation
+    """
+    assert ARCHIVE_BUCKET is not None, "ARCHIVE_BUCKET is not specified"
+    prefix = f"{ARCHIVE_PREFIX}dt={completed_date}/" if completed_date else ARCHIVE_PREFIX
+    manifests = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=ARCHIVE_BUCKET, Prefix=prefix):
+        manifests.extend(o['Key'] for o in page.get('Contents', []) if o['Key'].endswith('.manifest.json'))
+    # Evaluations complete before the post, their items can sit in other archive files
+    found = {}
+    for manifest_key in sorted(manifests, reverse=True):
+        manifest = json.loads(s3.get_object(Bucket=ARCHIVE_BUCKET, Key=manifest_key)['Body'].read())
+        if not any(belongs_to(entry['session_id'], session_id) for entry in manifest):
+            continue
+        archive_key = manifest_key[:-len('.manifest.json')] + '.jsonl.gz'
+        body = gzip.decompress(s3.get_object(Bucket=ARCHIVE_BUCKET, Key=archive_key)['Body'].read())
+        for line in body.decode('utf-8').splitlines():
+            item = json.loads(line)['Item'] if line else None
+            if item and belongs_to(item['session_id']['S'], session_id):
+                found.setdefault((item['session_id']['S'], item['agent_name']['S']), {k: _decode(v) for k, v in item.items()})
+    return list(found.values())
+
+
+def rehydrate_session(session_id, completed_date=None):
+    # Put an archived session back into the memory table, it expires again after REHYDRATED_SESSION_TTL_DAYS
+    items = find_archived_session(session_id, completed_date)
+    ttl = int(datetime.now(timezone.utc).timestamp()) + REHYDRATED_SESSION_TTL_DAYS * 24 * 3600
+    for item in items:
+        item['ttl'] = {'N': str(ttl)}
+        item['session_status'] = {'S': 'rehydrated'}
+        item.pop('archive_pending', None)
+        dynamodb.put_item(TableName=MEMORY_TABLE, Item=item)
+    logger.info(f"Rehydrated {len(items)} items of session_id {session_id}")
+    return {'session_id': session_id, 'rehydrated': len(items)}
+
+
+def lambda_handler(event, context):
+    # Scheduled events export, {'action': 'rehydrate', 'session_id': '...', 'completed_date': 'YYYY-MM-DD'} rehydrates
+    logger.info(f"Received event: {event}")
+    if event.get('action') == 'rehydrate':
+        assert event.get('session_id'), "Session ID is not specified"
+        return rehydrate_session(event['session_id'], event.get('completed_date'))
+    return export_completed_sessions()
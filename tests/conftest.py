@@ -0,0 +1,119 @@
+# Fixtures for tests of the agent functions against an in-process moto backend and a scripted model
+#
+# Usage:
+#   pip install -r tests/requirements.txt
+#   python -m pytest tests
+import copy
+import importlib
+import json
+import os
+import sys
+import boto3
+import pytest
+from moto import mock_aws
+from strands.models import Model
+
+FUNCTIONS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'functions'))
+MEMORY_TABLE = 'test-agent-memory-store'
+
+
+class ScriptedModel(Model):
+    """
+    Strands model answering with scripted assistant turns, records the messages of every call
+
+    Parameters:
+    turns (list): content blocks of each assistant turn, text or toolUse blocks
+    """
+    def __init__(self, turns):
+        self.turns = list(turns)
+        self.calls = []
+
+    def update_config(self, **model_config):
+        pass
+
+    def get_config(self):
+        return {}
+
+    async def structured_output(self, output_model, prompt, system_prompt=None, **kwargs):
+        raise NotImplementedError
+        yield
+
+    async def stream(self, messages, tool_specs=None, system_prompt=None, **kwargs):
+        self.calls.append(copy.deepcopy(messages))
+        assert self.turns, "Model called more often than scripted"
+        content = self.turns.pop(0)
+        yield {'messageStart': {'role': 'assistant'}}
+        for block in content:
+            if 'toolUse' in block:
+                tool_use = block['toolUse']
+                yield {'contentBlockStart': {'start': {'toolUse': {'toolUseId': tool_use['toolUseId'], 'name': tool_use['name']}}}}
+                yield {'contentBlockDelta': {'delta': {'toolUse': {'input': json.dumps(tool_use['input'])}}}}
+            else:
+                yield {'contentBlockStart': {'start': {}}}
+                yield {'contentBlockDelta': {'delta': {'text': block['text']}}}
+            yield {'contentBlockStop': {}}
+        stop_reason = 'tool_use' if any('toolUse' in block for block in content) else 'end_turn'
+        yield {'messageStop': {'stopReason': stop_reason}}
+
+
+class Context:
+    # Lambda context with a remaining time controlled by the test
+    def __init__(self, remaining_ms):
+        self.aws_request_id = 'test-request'
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms()
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('MEMORY_TABLE', MEMORY_TABLE)
+    with mock_aws():
+        boto3.client('dynamodb').create_table(
+            TableName=MEMORY_TABLE,
+            BillingMode='PAY_PER_REQUEST',
+            AttributeDefinitions=[
+                {'AttributeName': 'session_id', 'AttributeType': 'S'},
+                {'AttributeName': 'agent_name', 'AttributeType': 'S'},
+                {'AttributeName': 'archive_pending', 'AttributeType': 'S'},
+                {'AttributeName': 'completed_at', 'AttributeType': 'N'},
+            ],
+            KeySchema=[
+                {'AttributeName': 'session_id', 'KeyType': 'HASH'},
+                {'AttributeName': 'agent_name', 'KeyType': 'RANGE'},
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'archive-pending',
+                'KeySchema': [
+                    {'AttributeName': 'archive_pending', 'KeyType': 'HASH'},
+                    {'AttributeName': 'completed_at', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+            }]
+        )
+        yield boto3.resource('dynamodb').Table(MEMORY_TABLE)
+
+
+@pytest.fixture
+def load_function(monkeypatch):
+    # Imports a module of a function directory, index by default, function directories share module names
+    def load(name, module='index'):
+        for module_name, loaded in list(sys.modules.items()):
+            if (getattr(loaded, '__file__', None) or '').startswith(FUNCTIONS):
+                del sys.modules[module_name]
+        monkeypatch.syspath_prepend(os.path.join(FUNCTIONS, name))
+        return importlib.import_module(module)
+    yield load
+    for module_name, module in list(sys.modules.items()):
+        if (getattr(module, '__file__', None) or '').startswith(FUNCTIONS):
+            del sys.modules[module_name]
+
+
+def use_models(index, models):
+    # Serve every model tier from the given scripted models, keyed by tier
+    index.model_router._models.clear()
+    index.model_router._models.update(models)
@@ -0,0 +1,42 @@
+# A message deferred while escalating to a larger tier escalates again on redelivery
+import json
+import boto3
+
+from conftest import Context, ScriptedModel, use_models
+
+TASK = 'Evaluate this post: Rainbow unicorns for everyone!'
+UNREPORTED = [{'text': 'The post looks fine.'}]
+REPORT = [{'toolUse': {'toolUseId': 'report-1', 'name': 'publish_evaluation',
+                       'input': {'evaluation': 'APPROVED, it follows the brand guidelines.'}}}]
+
+
+def test_deferred_escalation_resumes_on_the_larger_tier(aws, load_function, monkeypatch):
+    queue_url = boto3.client('sqs').create_queue(QueueName='post-generator')['QueueUrl']
+    monkeypatch.setenv('POST_GENERATOR_AGENT_SQS_URL', queue_url)
+    index = load_function('evaluator_agent')
+    small, large = ScriptedModel([UNREPORTED]), ScriptedModel([REPORT])
+    use_models(index, {'small': small, 'large': large})
+    task = {
+        'type': 'new',
+        'body': {'task': TASK},
+        'parent': {'agent_name': 'post-generator-agent', 'session_id': 'post-session', 'tool_use_id': 'evaluate-1'},
+        'message_id': 'message-1',
+    }
+    context = Context(lambda: 10 ** 6)
+
+    # The small tier does not report its evaluation and the large tier has no capacity
+    acquire = index.rate_limiter.acquire
+    monkeypatch.setattr(index.rate_limiter, 'acquire',
+                        lambda model_id: (None, 30) if model_id == index.model_router.model_id('large') else acquire(model_id))
+    assert index.process(dict(task), context) == 30
+    monkeypatch.setattr(index.rate_limiter, 'acquire', acquire)
+    assert index.process(dict(task), context) is None
+
+    assert len(small.calls) == 1
+    # The large tier starts over from the task, not from the small tier's output
+    assert [message['role'] for message in large.calls[0]] == ['user']
+    session = aws.get_item(Key={'session_id': 'post-session#evaluate-1', 'agent_name': 'evaluator-agent'})['Item']
+    assert session['completion_reason'] == 'evaluated'
+    assert 'checkpoint_of' not in session
+    reports = boto3.client('sqs').receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10).get('Messages', [])
+    assert [json.loads(report['Body'])['body'][0]['toolResult']['toolUseId'] for report in reports] == ['evaluate-1']
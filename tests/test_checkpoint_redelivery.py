@@ -0,0 +1,70 @@
+# A message requeued when its invocation ran out of time resumes from the checkpoint on redelivery
+import responses
+
+from conftest import Context, ScriptedModel, use_models
+
+API_ENDPOINT = 'https://unitok.example.com/posts'
+TASK = 'Write a post about rainbow unicorns'
+PUBLISH = [{'toolUse': {'toolUseId': 'publish-1', 'name': 'publish_post', 'input': {'content': 'Rainbow unicorns!'}}}]
+DONE = [{'text': 'The post is published.'}]
+
+
+def new_task(message_id):
+    return {'type': 'new', 'body': {'task': TASK}, 'message_id': message_id}
+
+
+def load_generator(load_function, monkeypatch):
+    monkeypatch.setenv('PUBLISH_API_ENDPOINT', API_ENDPOINT)
+    return load_function('post_generator_agent')
+
+
+def session_item(table):
+    return next(item for item in table.scan()['Items'] if item['agent_name'] == 'post-generator-agent')
+
+
+def texts(message):
+    return [block['text'] for block in message['content'] if 'text' in block]
+
+
+@responses.activate
+def test_resumes_after_tool_result_without_repeating_the_task(aws, load_function, monkeypatch):
+    index = load_generator(load_function, monkeypatch)
+    api = responses.post(API_ENDPOINT, json={'postId': 'post-1'}, status=201)
+    model = ScriptedModel([PUBLISH, DONE])
+    use_models(index, {'small': model, 'large': model})
+    # Out of time as soon as the post is published, the checkpoint holds the publish_post result
+    context = Context(lambda: 0 if api.call_count else 10 ** 6)
+
+    assert index.process(new_task('message-1'), context) == 0
+    context.remaining_ms = lambda: 10 ** 6
+    assert index.process(new_task('message-1'), context) is None
+
+    assert api.call_count == 1
+    resumed = model.calls[-1]
+    assert [message['role'] for message in resumed] == ['user', 'assistant', 'user']
+    assert sum(TASK in text for message in resumed for text in texts(message)) == 1
+    assert 'toolResult' in resumed[-1]['content'][0]
+    session = session_item(aws)
+    assert session['completion_reason'] == 'published'
+    assert 'checkpoint_of' not in session
+
+
+@responses.activate
+def test_runs_checkpointed_tool_use_without_calling_the_model(aws, load_function, monkeypatch):
+    index = load_generator(load_function, monkeypatch)
+    api = responses.post(API_ENDPOINT, json={'postId': 'post-1'}, status=201)
+    model = ScriptedModel([PUBLISH, DONE])
+    use_models(index, {'small': model, 'large': model})
+    # Out of time right after the model asked for publish_post, before the tool ran
+    context = Context(lambda: 0)
+
+    assert index.process(new_task('message-1'), context) == 0
+    assert api.call_count == 0
+    context.remaining_ms = lambda: 10 ** 6
+    assert index.process(new_task('message-1'), context) is None
+
+    assert api.call_count == 1
+    # One model call before the interruption and one after the tool result, the toolUse turn is not paid twice
+    assert len(model.calls) == 2
+    assert [message['role'] for message in model.calls[-1]] == ['user', 'assistant', 'user']
+    assert session_item(aws)['completion_reason'] == 'published'
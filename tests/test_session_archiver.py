@@ -0,0 +1,76 @@
+# Completed sessions are archived to S3 and rehydrated together with their evaluator sessions
+import time
+import boto3
+import pytest
+
+BUCKET = 'test-session-archive'
+DAY = 24 * 3600
+
+
+@pytest.fixture
+def archiver(aws, load_function, monkeypatch):
+    monkeypatch.setenv('ARCHIVE_BUCKET', BUCKET)
+    boto3.client('s3').create_bucket(Bucket=BUCKET)
+    return load_function('session_archiver')
+
+
+def complete(table, session_id, agent_name, completed_at):
+    # Same attributes as mark_session_completed of the agents
+    table.put_item(Item={
+        'session_id': session_id,
+        'agent_name': agent_name,
+        'messages': [{'role': 'user', 'content': [{'text': f"Task of {session_id}"}]}],
+        'session_status': 'completed',
+        'completed_at': completed_at,
+        'archive_pending': time.strftime('%Y-%m-%d', time.gmtime(completed_at)),
+    })
+
+
+def test_rehydrates_evaluator_sessions_archived_on_another_day(aws, archiver):
+    # The evaluation completed the day before the post was published
+    now = int(time.time())
+    complete(aws, 'post-1#evaluate-1', 'evaluator-agent', now - DAY)
+    complete(aws, 'post-1', 'post-generator-agent', now)
+    complete(aws, 'post-10', 'post-generator-agent', now)
+    assert archiver.export_completed_sessions()['archived'] == 3
+    for item in aws.scan()['Items']:
+        aws.delete_item(Key={'session_id': item['session_id'], 'agent_name': item['agent_name']})
+
+    assert archiver.rehydrate_session('post-1')['rehydrated'] == 2
+
+    items = aws.scan()['Items']
+    assert sorted(item['session_id'] for item in items) == ['post-1', 'post-1#evaluate-1']
+    assert {item['session_status'] for item in items} == {'rehydrated'}
+    assert not any('archive_pending' in item for item in items)
+
+
+def test_exports_only_sessions_pending_archival(aws, archiver):
+    now = int(time.time())
+    complete(aws, 'post-1', 'post-generator-agent', now - 2 * DAY)
+    complete(aws, 'post-2', 'post-generator-agent', now)
+    aws.put_item(Item={'session_id': 'post-3', 'agent_name': 'post-generator-agent', 'messages': []})
+
+    assert archiver.export_completed_sessions()['archived'] == 2
+    assert archiver.export_completed_sessions()['archived'] == 0
+    archived = {item['session_id']: item for item in aws.scan()['Items'] if 'archived_at' in item}
+    assert sorted(archived) == ['post-1', 'post-2']
+    assert not any('archive_pending' in item for item in archived.values())
+
+
+def test_skips_sessions_expired_while_exporting(aws, archiver, monkeypatch):
+    now = int(time.time())
+    complete(aws, 'post-1', 'post-generator-agent', now)
+    complete(aws, 'post-2', 'post-generator-agent', now)
+    completed_sessions = archiver.completed_sessions
+
+    def expiring():
+        yield from completed_sessions()
+        # TTL deletes post-1 between the index query and the update
+        aws.delete_item(Key={'session_id': 'post-1', 'agent_name': 'post-generator-agent'})
+
+    monkeypatch.setattr(archiver, 'completed_sessions', expiring)
+    assert archiver.export_completed_sessions()['archived'] == 2
+
+    items = aws.scan()['Items']
+    assert [item['session_id'] for item in items] == ['post-2']
+    assert 'archived_at' in items[0] and 'archive_pending' not in items[0]
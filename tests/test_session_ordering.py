@@ -0,0 +1,100 @@
+# A message finding its session locked schedules a drain, so a dead holder does not strand the inbox
+import time
+
+from conftest import Context
+
+SESSION_ID = 'session-1'
+AGENT_NAME = 'post-generator-agent'
+
+
+def lock(table, owner, expires_in_ms):
+    table.put_item(Item={
+        'session_id': SESSION_ID,
+        'agent_name': f"{AGENT_NAME}#inbox",
+        'lock_owner': owner,
+        'lock_expires': int(time.time() * 1000) + expires_in_ms,
+    })
+
+
+def test_locked_session_schedules_one_drain_after_the_lease(aws, load_function):
+    session_ordering = load_function('post_generator_agent').session_ordering
+    lock(aws, 'dead-holder', 20000)
+    session_ordering.enqueue(SESSION_ID, AGENT_NAME, 'message-1', time.time() * 1000, {'message_id': 'message-1'})
+    nudges, processed = [], []
+
+    for owner in ('invocation-1', 'invocation-2'):
+        assert session_ordering.drain(SESSION_ID, AGENT_NAME, owner, processed.append, nudges.append) == 0
+
+    assert processed == []
+    # Only the first invocation schedules a drain, for right after the lease runs out
+    assert len(nudges) == 1 and 20 <= nudges[0] <= 22
+
+
+def test_drain_takes_over_an_expired_lock(aws, load_function):
+    session_ordering = load_function('post_generator_agent').session_ordering
+    lock(aws, 'dead-holder', -1000)
+    session_ordering.enqueue(SESSION_ID, AGENT_NAME, 'message-1', time.time() * 1000, {'message_id': 'message-1'})
+    processed = []
+
+    drained = session_ordering.drain(SESSION_ID, AGENT_NAME, 'invocation-1', processed.append, lambda delay: None,
+                                     remaining_ms=Context(lambda: 10 ** 6).get_remaining_time_in_millis)
+
+    assert drained == 1
+    assert processed == [{'message_id': 'message-1'}]
+    item = aws.get_item(Key={'session_id': SESSION_ID, 'agent_name': f"{AGENT_NAME}#inbox"})['Item']
+    assert 'lock_owner' not in item and item['pending'] == []
+
+
+def inbox(table):
+    return table.get_item(Key={'session_id': SESSION_ID, 'agent_name': f"{AGENT_NAME}#inbox"})['Item']
+
+
+def test_empty_inbox_expires_until_the_next_message(aws, load_function):
+    session_ordering = load_function('post_generator_agent').session_ordering
+    session_ordering.enqueue(SESSION_ID, AGENT_NAME, 'message-1', time.time() * 1000, {'message_id': 'message-1'})
+    released_after = int(time.time())
+    session_ordering.drain(SESSION_ID, AGENT_NAME, 'invocation-1', lambda task: None, lambda delay: None)
+
+    assert int(inbox(aws)['ttl']) >= released_after + session_ordering.DEDUP_SECONDS
+    # A redelivery within the window is still recognised, a new message keeps the inbox alive
+    session_ordering.enqueue(SESSION_ID, AGENT_NAME, 'message-1', time.time() * 1000, {'message_id': 'message-1'})
+    assert 'ttl' in inbox(aws) and inbox(aws)['pending'] == []
+    session_ordering.enqueue(SESSION_ID, AGENT_NAME, 'message-2', time.time() * 1000, {'message_id': 'message-2'})
+    assert 'ttl' not in inbox(aws) and len(inbox(aws)['pending']) == 1
+
+
+def test_message_ids_are_rotated_out_after_the_dedup_window(aws, load_function):
+    session_ordering = load_function('post_generator_agent').session_ordering
+    processed = []
+
+    def deliver(message_id):
+        session_ordering.enqueue(SESSION_ID, AGENT_NAME, message_id, time.time() * 1000, {'message_id': message_id})
+        session_ordering.drain(SESSION_ID, AGENT_NAME, 'invocation-1', processed.append, lambda delay: None)
+
+    def age_generation():
+        aws.update_item(Key={'session_id': SESSION_ID, 'agent_name': f"{AGENT_NAME}#inbox"},
+                        UpdateExpression='SET message_ids_since = :since',
+                        ExpressionAttributeValues={':since': int(time.time()) - session_ordering.DEDUP_SECONDS - 1})
+
+    deliver('message-1')
+    deliver('message-2')
+    assert inbox(aws)['message_ids'] == {'message-1', 'message-2'}
+    # Releasing after the window moves the ids to the previous generation, where redeliveries are still caught
+    age_generation()
+    deliver('message-3')
+    assert 'message_ids' not in inbox(aws)
+    assert inbox(aws)['previous_message_ids'] == {'message-1', 'message-2', 'message-3'}
+    deliver('message-1')
+    # The next rotation drops them
+    deliver('message-4')
+    age_generation()
+    deliver('message-5')
+    assert inbox(aws)['previous_message_ids'] == {'message-4', 'message-5'}
+    assert [task['message_id'] for task in processed] == ['message-1', 'message-2', 'message-3', 'message-4', 'message-5']
+
+
+def test_speculation_bypasses_the_session_inbox(aws, load_function):
+    session_ordering = load_function('post_generator_agent').session_ordering
+
+    assert session_ordering.session_key({'type': 'speculate', 'session_id': SESSION_ID, 'tool_use_id': 'approval-1'}) is None
+    assert session_ordering.session_key({'type': 'existing', 'session_id': SESSION_ID}) == SESSION_ID
@@ -0,0 +1,47 @@
+# The evaluated alternative of a denied approval survives the denial being deferred and redelivered
+import pytest
+
+SESSION_ID = 'post-session'
+AGENT_NAME = 'post-generator-agent'
+APPROVAL = 'approval-1'
+
+
+@pytest.fixture
+def index(aws, load_function, monkeypatch):
+    monkeypatch.setenv('SPECULATIVE_REVISION', 'enabled')
+    index = load_function('post_generator_agent')
+    aws.put_item(Item={'session_id': SESSION_ID, 'agent_name': AGENT_NAME, 'messages': [],
+                       'pending_tool_use_ids': [APPROVAL]})
+    speculation = index.speculation
+    assert speculation.reserve(SESSION_ID, AGENT_NAME, APPROVAL, 'speculate-1')
+    assert speculation.store_candidate(SESSION_ID, AGENT_NAME, APPROVAL, 'Sparkly unicorns for all!')
+    assert speculation.store_evaluation(SESSION_ID, AGENT_NAME, APPROVAL, 'APPROVED, on brand.')
+    return index
+
+
+def denial(message_id):
+    return {
+        'type': 'existing',
+        'session_id': SESSION_ID,
+        'message_id': message_id,
+        'body': [{'toolResult': {'toolUseId': APPROVAL, 'status': 'success', 'content': [{'text': 'Post denied'}]}}],
+    }
+
+
+def test_redelivered_denial_presents_the_alternative_again(index):
+    first = index.present_speculation(denial('denial-1'))
+    # The run was deferred, e.g. no Bedrock capacity, the same message comes back
+    again = index.present_speculation(denial('denial-1'))
+
+    assert first['speculative'] and again['speculative']
+    assert again['body'] == first['body']
+    assert 'Sparkly unicorns for all!' in again['body'][0]['toolResult']['content'][-1]['text']
+
+
+def test_taken_slot_is_not_handed_out_or_overwritten(index):
+    index.present_speculation(denial('denial-1'))
+
+    assert 'speculative' not in index.present_speculation(denial('denial-2'))
+    # Speculative work still in flight for the resolved approval stops
+    assert not index.speculation.store_candidate(SESSION_ID, AGENT_NAME, APPROVAL, 'Late candidate')
+    assert not index.speculation.reserve(SESSION_ID, AGENT_NAME, APPROVAL, 'speculate-1')
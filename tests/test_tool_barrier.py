@@ -0,0 +1,90 @@
+# Join barrier of async tool results, the agent resumes exactly once with every result of the turn
+import pytest
+
+SESSION_ID = 'post-session'
+AGENT_NAME = 'post-generator-agent'
+
+
+@pytest.fixture
+def tool_barrier(aws, load_function):
+    return load_function('post_generator_agent', 'tool_barrier')
+
+
+def result(tool_use_id, text='APPROVED'):
+    return {'toolUseId': tool_use_id, 'status': 'success', 'content': [{'text': text}]}
+
+
+@pytest.mark.parametrize('order', [['evaluate-1', 'evaluate-2'], ['evaluate-2', 'evaluate-1']])
+def test_resumes_once_all_results_arrived_in_either_order(tool_barrier, order):
+    tool_barrier.wait_for(SESSION_ID, AGENT_NAME, ['evaluate-1', 'evaluate-2'])
+
+    assert tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result(order[0])], 'message-1') == ('waiting', None)
+    state, results = tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result(order[1])], 'message-2')
+
+    assert state == 'ready'
+    # In the order the tools were dispatched
+    assert [r['toolUseId'] for r in results] == ['evaluate-1', 'evaluate-2']
+
+
+def test_redelivered_completing_message_resumes_with_the_same_results(tool_barrier):
+    tool_barrier.wait_for(SESSION_ID, AGENT_NAME, ['evaluate-1', 'evaluate-2'])
+    tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-1')], 'message-1')
+    completed = tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-2')], 'message-2')
+
+    assert tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-2')], 'message-2') == completed
+    # A duplicate of a joined result in another message does not resume the agent a second time
+    assert tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-2')], 'message-3') == ('waiting', None)
+    assert tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-1')], 'message-1') == ('waiting', None)
+
+
+def test_stale_results_are_dropped(tool_barrier):
+    tool_barrier.wait_for(SESSION_ID, AGENT_NAME, ['evaluate-1'])
+    tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-1')], 'message-1')
+    # The next turn waits on a new tool, a late result of the previous round must not complete it
+    tool_barrier.wait_for(SESSION_ID, AGENT_NAME, ['approval-1'])
+
+    assert tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-1')], 'message-2') == ('waiting', None)
+    state, results = tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-1'), result('approval-1', 'approved')],
+                                         'message-3')
+    assert state == 'ready'
+    assert [r['toolUseId'] for r in results] == ['approval-1']
+
+
+def test_join_timeout_resumes_with_errors_for_missing_results(aws, tool_barrier, monkeypatch):
+    monkeypatch.setattr(tool_barrier, 'JOIN_TIMEOUT_SECONDS', 60)
+    since = tool_barrier.wait_for(SESSION_ID, AGENT_NAME, ['evaluate-1', 'evaluate-2'])
+    tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-1')], 'message-1')
+
+    state, left = tool_barrier.expire(SESSION_ID, AGENT_NAME, since, 'timeout-1')
+    assert state == 'waiting' and 0 < left <= 60
+
+    monkeypatch.setattr(tool_barrier, 'JOIN_TIMEOUT_SECONDS', 0)
+    state, results = tool_barrier.expire(SESSION_ID, AGENT_NAME, since, 'timeout-1')
+    assert state == 'ready'
+    assert [(r['toolUseId'], r['status']) for r in results] == [('evaluate-1', 'success'), ('evaluate-2', 'error')]
+    # Redelivery of the timeout resumes with the same results, the late result and other timeouts do nothing
+    assert tool_barrier.expire(SESSION_ID, AGENT_NAME, since, 'timeout-1') == ('ready', results)
+    assert tool_barrier.expire(SESSION_ID, AGENT_NAME, since, 'timeout-2') == ('done', None)
+    assert tool_barrier.arrive(SESSION_ID, AGENT_NAME, [result('evaluate-2')], 'message-2') == ('waiting', None)
+
+
+def test_splice_replaces_placeholder_results(tool_barrier):
+    placeholder = {'toolUseId': 'evaluate-1', 'status': 'success', 'content': [{'text': 'Evaluation requested'}]}
+    other = {'toolUseId': 'search-1', 'status': 'success', 'content': [{'text': 'Unicorn facts'}]}
+    approval = {'toolUseId': 'approval-1', 'status': 'success', 'content': [{'text': 'Approval requested'}]}
+    messages = [
+        {'role': 'user', 'content': [{'text': 'Write a post'}]},
+        {'role': 'assistant', 'content': [{'toolUse': {'toolUseId': t, 'name': 'tool', 'input': {}}}
+                                          for t in ('evaluate-1', 'search-1', 'approval-1')]},
+        {'role': 'user', 'content': [{'toolResult': placeholder}, {'toolResult': other}, {'toolResult': approval}]},
+    ]
+
+    spliced = tool_barrier.splice(messages, [result('approval-1', 'approved'), result('evaluate-1')])
+
+    assert spliced[:-1] == messages[:-1]
+    assert [block['toolResult'] for block in spliced[-1]['content']] == [
+        result('evaluate-1'), other, result('approval-1', 'approved')]
+    assert tool_barrier.splice(messages, [result('evaluate-9')]) is None
+    # Stopped before the placeholders were recorded, the results become the next user message
+    appended = tool_barrier.splice(messages[:-1], [result('evaluate-1')])
+    assert appended[-1] == {'role': 'user', 'content': [{'toolResult': result('evaluate-1')}]}
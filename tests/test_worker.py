@@ -0,0 +1,66 @@
+# The long-poll of an idle queue does not keep the worker from running messages of a busy queue
+import asyncio
+import threading
+import time
+
+CONCURRENCY = 8
+MESSAGES = 80
+RUN_SECONDS = 0.05
+
+
+class FakeSQS:
+    # Queues held in memory, an empty queue answers after the long-poll wait like SQS
+    def __init__(self, queues):
+        self.queues = {url: list(messages) for url, messages in queues.items()}
+        self.lock = threading.Lock()
+        self.deleted = []
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds, **kwargs):
+        with self.lock:
+            messages = self.queues[QueueUrl][:MaxNumberOfMessages]
+            del self.queues[QueueUrl][:len(messages)]
+        if not messages:
+            time.sleep(WaitTimeSeconds)
+        return {'Messages': messages}
+
+    def change_message_visibility(self, **kwargs):
+        pass
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        with self.lock:
+            self.deleted.append(ReceiptHandle)
+
+
+def test_idle_queue_does_not_hold_slots(aws, load_function, monkeypatch):
+    worker = load_function('post_generator_agent', 'worker')
+    monkeypatch.setattr(worker, 'WAIT_TIME_SECONDS', 0.5)
+    busy = [{'MessageId': f"m-{i}", 'ReceiptHandle': f"r-{i}", 'Body': '{}'} for i in range(MESSAGES)]
+    sqs = FakeSQS({'busy': busy, 'idle': []})
+    running, peak = [], []
+    lock = threading.Lock()
+
+    def handler(event, context):
+        with lock:
+            running.append(event)
+            peak.append(len(running))
+        time.sleep(RUN_SECONDS)
+        with lock:
+            running.remove(event)
+
+    async def run():
+        instance = worker.Worker(handler, ['idle', 'busy'], CONCURRENCY)
+        instance.sqs = sqs
+        task = asyncio.create_task(instance.run())
+        deadline = time.monotonic() + 10
+        while len(sqs.deleted) < MESSAGES and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        instance.stop()
+        await task
+
+    started = time.monotonic()
+    asyncio.run(run())
+
+    assert len(sqs.deleted) == MESSAGES
+    assert max(peak) == CONCURRENCY
+    # Run back to back on all slots, one at a time would take MESSAGES * RUN_SECONDS
+    assert time.monotonic() - started < MESSAGES * RUN_SECONDS / 2
@@ -0,0 +1,277 @@
+# Load test and latency benchmark of the UniTok backend handlers (functions/publish-post, functions/get-posts)
+# Seeds a posts table with a synthetic corpus across unicorn colors and authors, then drives both
+# lambda_handler functions from a pool of threads with a mixed read/write workload. Reports p50/p95/p99
+# latency, items and bytes per response and handler CPU time per operation, and writes them to a JSON
+# result file so runs before and after a change to the feed path can be compared.
+#
+# Operations:
+#   publish  - publish-post with a new post
+#   feed     - get-posts without parameters, the top 50
+#   since    - get-posts with a `since` watermark a few seconds back, as a polling client sends it
+#
+# Usage:
+#   pip install -r benchmarks/requirements.txt
+#   python benchmarks/handlers_latency.py --posts 100000 --threads 16 --seconds 30 --label baseline
+#   python benchmarks/handlers_latency.py --posts 100000 --threads 16 --seconds 30 --compare benchmarks/results/<file>.json
+# Runs against an in-process moto DynamoDB by default. moto serves a GSI query by sorting the whole index
+# in the calling thread and is not safe for concurrent writes, so calls are serialised and its latencies and
+# CPU times include the stand-in itself. Use DynamoDB Local (--endpoint-url http://localhost:8000) for large
+# corpora and concurrent numbers, seeding a million posts there takes a few minutes.
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('POSTS_TABLE', 'benchmark-unitok-posts')
+
+import boto3
+import moto_support
+
+RESULTS = os.path.join(os.path.dirname(__file__), 'results')
+COLORS = ['pink', 'blue', 'purple', 'green', 'yellow', 'rainbow']
+AUTHORS = 500
+WORDS = ('unicorn magical rainbow sparkle gallop meadow rent family party dream glitter horn '
+         'adventure pick favorite color fly wonder joy friends kids').split()
+OPERATIONS = ['publish', 'feed', 'since']
+# Watermark age of `since` requests, a client polling every few seconds
+SINCE_WINDOW_MS = 5000
+
+
+def create_posts_table(endpoint_url):
+    # Same keys and index as PostsTable in infrastructure/lib/unitok-stack.ts
+    dynamodb = boto3.client('dynamodb', endpoint_url=endpoint_url)
+    table_name = os.environ['POSTS_TABLE']
+    if table_name in dynamodb.list_tables()['TableNames']:
+        dynamodb.delete_table(TableName=table_name)
+        dynamodb.get_waiter('table_not_exists').wait(TableName=table_name)
+    dynamodb.create_table(
+        TableName=table_name,
+        BillingMode='PAY_PER_REQUEST',
+        AttributeDefinitions=[
+            {'AttributeName': 'postId', 'AttributeType': 'S'},
+            {'AttributeName': 'dummy', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'N'},
+        ],
+        KeySchema=[{'AttributeName': 'postId', 'KeyType': 'HASH'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'TimestampIndex',
+            'KeySchema': [
+                {'AttributeName': 'dummy', 'KeyType': 'HASH'},
+                {'AttributeName': 'timestamp', 'KeyType': 'RANGE'},
+            ],
+            'Projection': {'ProjectionType': 'ALL'},
+        }]
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=table_name)
+
+
+def synthetic_post(rng, timestamp):
+    # Shaped like the posts publish-post writes
+    return {
+        'postId': str(uuid.UUID(int=rng.getrandbits(128))),
+        'content': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))),
+        'author': f"Unicorn Fan {rng.randrange(AUTHORS)}",
+        'imageUrl': None,
+        'unicornColor': rng.choice(COLORS),
+        'timestamp': timestamp,
+        'likes': rng.randrange(1000),
+        'dummy': 'POST'
+    }
+
+
+def seed(endpoint_url, posts, seed_value):
+    # Posts spread over the last 30 days, written with batch writes from a few threads
+    rng = random.Random(seed_value)
+    now = int(time.time() * 1000)
+    span = 30 * 24 * 3600 * 1000
+    timestamps = sorted(now - rng.randrange(span) for _ in range(posts))
+    batches = [timestamps[i:i + 25] for i in range(0, posts, 25)]
+    table = boto3.resource('dynamodb', endpoint_url=endpoint_url).Table(os.environ['POSTS_TABLE'])
+    started = time.monotonic()
+
+    def write(worker):
+        worker_rng = random.Random(seed_value * 1000 + worker)
+        with table.batch_writer() as batch:
+            for timestamps_batch in batches[worker::4]:
+                for timestamp in timestamps_batch:
+                    batch.put_item(Item=synthetic_post(worker_rng, timestamp))
+
+    workers = [threading.Thread(target=write, args=(w,)) for w in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    print(f"Seeded {posts} posts in {time.monotonic() - started:.1f} s")
+
+
+def request_for(operation, rng):
+    if operation == 'publish':
+        post = synthetic_post(rng, 0)
+        body = {'content': post['content'], 'author': post['author'], 'unicornColor': post['unicornColor']}
+        return {'body': json.dumps(body)}
+    if operation == 'since':
+        since = int(time.time() * 1000) - SINCE_WINDOW_MS
+        return {'queryStringParameters': {'since': str(since)}}
+    return {'queryStringParameters': None}
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    summary = {}
+    for operation in OPERATIONS:
+        operation_samples = [s for s in samples if s['operation'] == operation]
+        if not operation_samples:
+            continue
+        latencies = [s['latency_ms'] for s in operation_samples]
+        cpu = [s['cpu_ms'] for s in operation_samples]
+        summary[operation] = {
+            'requests': len(operation_samples),
+            'errors': sum(1 for s in operation_samples if s['status'] >= 400),
+            'latency_ms': {'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                           'p99': percentile(latencies, 99), 'max': max(latencies)},
+            'cpu_ms': {'mean': sum(cpu) / len(cpu), 'p95': percentile(cpu, 95)},
+            'items_per_response': sum(s['items'] for s in operation_samples) / len(operation_samples),
+            'bytes_per_response': sum(s['bytes'] for s in operation_samples) / len(operation_samples),
+        }
+    return summary
+
+
+def run(handlers, mix, threads, seconds, seed_value):
+    samples = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+    operations, weights = zip(*mix.items())
+
+    def consume(worker):
+        rng = random.Random(seed_value * 7919 + worker)
+        worker_samples = []
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            event = request_for(operation, rng)
+            # Thread CPU time covers the handler and its SDK calls, but not other threads
+            cpu_started = time.thread_time()
+            started = time.perf_counter()
+            response = handlers[operation].lambda_handler(event, None)
+            latency_ms = (time.perf_counter() - started) * 1000
+            cpu_ms = (time.thread_time() - cpu_started) * 1000
+            body = json.loads(response['body'])
+            worker_samples.append({
+                'operation': operation,
+                'status': response['statusCode'],
+                'latency_ms': latency_ms,
+                'cpu_ms': cpu_ms,
+                'items': len(body) if isinstance(body, list) else 1,
+                'bytes': len(response['body'].encode('utf-8')),
+            })
+        with lock:
+            samples.extend(worker_samples)
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=consume, args=(w,)) for w in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return samples, time.monotonic() - started
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_summary(summary, baseline=None):
+    print(f"{'operation':<9} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'cpu ms':>7} {'items':>6} {'bytes':>8}")
+    for operation, stats in summary.items():
+        print(f"{operation:<9} {stats['requests']:>8} {stats['errors']:>6} {stats['latency_ms']['p50']:>8.2f} "
+              f"{stats['latency_ms']['p95']:>8.2f} {stats['latency_ms']['p99']:>8.2f} {stats['cpu_ms']['mean']:>7.2f} "
+              f"{stats['items_per_response']:>6.1f} {stats['bytes_per_response']:>8.0f}")
+        before = (baseline or {}).get(operation)
+        if before:
+            change = lambda now, then: f"{(now - then) / then * 100:+.0f}%" if then else 'n/a'
+            print(f"{'  vs base':<9} {'':>8} {'':>6} {change(stats['latency_ms']['p50'], before['latency_ms']['p50']):>8} "
+                  f"{change(stats['latency_ms']['p95'], before['latency_ms']['p95']):>8} "
+                  f"{change(stats['latency_ms']['p99'], before['latency_ms']['p99']):>8} "
+                  f"{change(stats['cpu_ms']['mean'], before['cpu_ms']['mean']):>7} "
+                  f"{change(stats['items_per_response'], before['items_per_response']):>6} "
+                  f"{change(stats['bytes_per_response'], before['bytes_per_response']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the UniTok backend handlers')
+    parser.add_argument('--posts', type=int, default=10000, help='synthetic posts to seed, up to 1000000')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--mix', default='publish=10,feed=30,since=60', help='operation weights')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--label', default='run', help='name of the result file')
+    parser.add_argument('--compare', default=None, help='result file to compare against')
+    parser.add_argument('--endpoint-url', default=None, help='DynamoDB endpoint, in-process moto when omitted')
+    args = parser.parse_args()
+    assert 0 < args.posts <= 1000000, "--posts must be between 1 and 1000000"
+    mix = {operation: float(weight) for operation, weight in (part.split('=') for part in args.mix.split(','))}
+    assert set(mix) <= set(OPERATIONS), f"Operations must be among {OPERATIONS}"
+
+    if args.endpoint_url is None:
+        from moto import mock_aws
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+        mock = mock_aws()
+        mock.start()
+        moto_support.serialize_calls()
+    create_posts_table(args.endpoint_url)
+    seed(args.endpoint_url, args.posts, args.seed)
+
+    publish_post = moto_support.load_handler('publish-post')
+    get_posts = moto_support.load_handler('get-posts')
+    if args.endpoint_url:
+        publish_post.dynamodb = get_posts.dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+    handlers = {'publish': publish_post, 'feed': get_posts, 'since': get_posts}
+
+    samples, elapsed = run(handlers, mix, args.threads, args.seconds, args.seed)
+    summary = summarize(samples)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['operations']
+    print(f"{len(samples)} requests in {elapsed:.1f} s, {len(samples) / elapsed:.1f} requests/s")
+    print_summary(summary, baseline)
+
+    os.makedirs(RESULTS, exist_ok=True)
+    started_at = datetime.now(timezone.utc)
+    path = os.path.join(RESULTS, f"{started_at:%Y%m%dT%H%M%SZ}-{args.label}.json")
+    with open(path, 'w') as f:
+        json.dump({
+            'label': args.label,
+            'commit': git_commit(),
+            'started_at': started_at.isoformat(),
+            'stand_in': args.endpoint_url or 'moto',
+            'posts': args.posts,
+            'threads': args.threads,
+            'seconds': args.seconds,
+            'mix': mix,
+            'seed': args.seed,
+            'requests_per_second': len(samples) / elapsed,
+            'operations': summary,
+        }, f, indent=2)
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# Benchmark of sustained likes per second on a single hot post (functions/like-post, functions/rollup-likes)
+# Drives the like-post handler from a pool of threads, every like from a distinct user, for a fixed
+# duration per shard count, then rolls the shards up onto the post and checks that no like was lost.
+#
+# Usage:
+#   pip install -r benchmarks/requirements.txt
+#   python benchmarks/likes_throughput.py --shards 1,4,10,20 --threads 32 --seconds 10
+# Runs against an in-process moto DynamoDB by default, which measures handler overhead only. Partition
+# throughput limits, which sharding exists for, only show against DynamoDB: pass --endpoint-url, e.g.
+# https://dynamodb.us-east-1.amazonaws.com, the benchmark creates and deletes its own tables.
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('POSTS_TABLE', 'benchmark-unitok-posts')
+os.environ.setdefault('LIKES_TABLE', 'benchmark-unitok-likes')
+
+import boto3
+import moto_support
+
+# A transactional write of an item under 1 KB costs 2 WCU, a single item sustains 1000 WCU per second
+WCU_PER_ITEM_SECOND = 1000
+WCU_PER_TRANSACTIONAL_WRITE = 2
+
+
+def load_handler(function_name, shards):
+    # The shard count is read at import, every shard count gets its own module
+    os.environ['LIKE_SHARDS'] = str(shards)
+    return moto_support.load_handler(function_name, f"{function_name.replace('-', '_')}_{shards}")
+
+
+def create_tables(endpoint_url):
+    dynamodb = boto3.client('dynamodb', endpoint_url=endpoint_url)
+    tables = {
+        os.environ['POSTS_TABLE']: 'postId',
+        os.environ['LIKES_TABLE']: 'pk',
+    }
+    existing = dynamodb.list_tables()['TableNames']
+    for table_name, key in tables.items():
+        if table_name in existing:
+            dynamodb.delete_table(TableName=table_name)
+            dynamodb.get_waiter('table_not_exists').wait(TableName=table_name)
+        dynamodb.create_table(
+            TableName=table_name,
+            BillingMode='PAY_PER_REQUEST',
+            AttributeDefinitions=[{'AttributeName': key, 'AttributeType': 'S'}],
+            KeySchema=[{'AttributeName': key, 'KeyType': 'HASH'}]
+        )
+    for table_name in tables:
+        dynamodb.get_waiter('table_exists').wait(TableName=table_name)
+
+
+def delete_tables(endpoint_url):
+    dynamodb = boto3.client('dynamodb', endpoint_url=endpoint_url)
+    for table_name in (os.environ['POSTS_TABLE'], os.environ['LIKES_TABLE']):
+        dynamodb.delete_table(TableName=table_name)
+
+
+def run(like_post, rollup_likes, endpoint_url, shards, threads, seconds):
+    post_id = str(uuid.uuid4())
+    boto3.resource('dynamodb', endpoint_url=endpoint_url).Table(os.environ['POSTS_TABLE']).put_item(
+        Item={'postId': post_id, 'content': 'Hot post', 'timestamp': int(time.time() * 1000), 'likes': 0, 'dummy': 'POST'})
+    stats = {'counted': 0, 'duplicates': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def consume():
+        counted = duplicates = errors = 0
+        while time.monotonic() < deadline:
+            user_id = str(uuid.uuid4())
+            for _ in range(2):
+                # Every user likes twice, the second like must not be counted
+                response = like_post.lambda_handler(
+                    {'pathParameters': {'postId': post_id}, 'body': json.dumps({'userId': user_id})}, None)
+                if response['statusCode'] != 200:
+                    errors += 1
+                elif json.loads(response['body'])['counted']:
+                    counted += 1
+                else:
+                    duplicates += 1
+        with lock:
+            stats['counted'] += counted
+            stats['duplicates'] += duplicates
+            stats['errors'] += errors
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=consume) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.monotonic() - started
+
+    # One stream batch naming the post, as the filtered event source delivers it
+    rollup_likes.lambda_handler({'Records': [{'dynamodb': {'NewImage': {'postId': {'S': post_id}, 'kind': {'S': 'shard'}}}}]}, None)
+    rolled_up = int(boto3.resource('dynamodb', endpoint_url=endpoint_url).Table(os.environ['POSTS_TABLE']).get_item(
+        Key={'postId': post_id})['Item']['likes'])
+    return {
+        'likes_per_second': stats['counted'] / elapsed,
+        'counted': stats['counted'],
+        'duplicates': stats['duplicates'],
+        'errors': stats['errors'],
+        'rolled_up': rolled_up,
+        # Hot shard items bound throughput, user markers are spread over the table
+        'ceiling': shards * WCU_PER_ITEM_SECOND / WCU_PER_TRANSACTIONAL_WRITE,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', default='1,4,10,20', help='comma separated shard counts to sweep')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--endpoint-url', default=None, help='DynamoDB endpoint, in-process moto when omitted')
+    args = parser.parse_args()
+
+    if args.endpoint_url is None:
+        from moto import mock_aws
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+        mock = mock_aws()
+        mock.start()
+        moto_support.serialize_calls()
+    create_tables(args.endpoint_url)
+
+    print(f"{'shards':>6} {'likes/s':>9} {'ceiling/s':>10} {'counted':>8} {'dupes':>7} {'errors':>7} {'rolled up':>10}")
+    try:
+        for shards in [int(s) for s in args.shards.split(',')]:
+            like_post = load_handler('like-post', shards)
+            rollup_likes = load_handler('rollup-likes', shards)
+            if args.endpoint_url:
+                like_post.dynamodb = rollup_likes.dynamodb = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+            result = run(like_post, rollup_likes, args.endpoint_url, shards, args.threads, args.seconds)
+            print(f"{shards:>6} {result['likes_per_second']:>9.1f} {result['ceiling']:>10.0f} {result['counted']:>8} "
+                  f"{result['duplicates']:>7} {result['errors']:>7} {result['rolled_up']:>10}")
+            assert result['rolled_up'] == result['counted'], "Rolled up likes do not match counted likes"
+    finally:
+        if args.endpoint_url:
+            delete_tables(args.endpoint_url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# Helpers shared by the UniTok backend benchmarks that run against an in-process moto backend
+import importlib.util
+import os
+import threading
+from botocore.client import BaseClient
+
+FUNCTIONS = os.path.join(os.path.dirname(__file__), '..', 'functions')
+
+
+def serialize_calls(service='dynamodb'):
+    # moto applies concurrent transactions without isolation, unlike DynamoDB, and is not safe for writes
+    # while an index is being queried. Calls to the service are serialised, across every boto3 session,
+    # to keep its results linearizable. Use DynamoDB or DynamoDB Local for contention numbers.
+    lock = threading.Lock()
+    make_api_call = BaseClient._make_api_call
+
+    def serialized(client, operation_name, api_params):
+        if client.meta.service_model.service_name != service:
+            return make_api_call(client, operation_name, api_params)
+        with lock:
+            return make_api_call(client, operation_name, api_params)
+
+    BaseClient._make_api_call = serialized
+
+
+def load_handler(function_name, module_name=None):
+    # Every function is a lambda_function module, load each under its own name with its prints silenced
+    spec = importlib.util.spec_from_file_location(
+        module_name or function_name.replace('-', '_'), os.path.join(FUNCTIONS, function_name, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.print = lambda *args, **kwargs: None
+    return module
@@ -1,5 +1,6 @@
 import json
 import os
+import time
 import boto3
 import decimal
 from boto3.dynamodb.conditions import Key
@@ -7,6 +8,11 @@ from boto3.dynamodb.conditions import Key
 # Initialize DynamoDB client
 dynamodb = boto3.resource('dynamodb')
 
+# Long-polls for new posts are capped below the API Gateway integration timeout
+MAX_WAIT_SECONDS = int(os.environ.get('MAX_WAIT_SECONDS', '20'))
+POLL_INTERVAL_SECONDS = 1
+PAGE_SIZE = 50
+
 # Helper class to convert a DynamoDB item to JSON
 class DecimalEncoder(json.JSONEncoder):
     def default(self, o):
@@ -17,22 +23,49 @@ class DecimalEncoder(json.JSONEncoder):
                 return int(o)
         return super(DecimalEncoder, self).default(o)
 
+def query_newer(table, since, since_id=None):
+    # Posts published after the watermark, oldest first so a client that gets a full page can continue from it.
+    # Posts published in the same millisecond as the watermark post are returned again, clients merge by postId.
+    condition = Key('dummy').eq('POST') & (Key('timestamp').gte(since) if since_id else Key('timestamp').gt(since))
+    response = table.query(
+        IndexName='TimestampIndex',
+        KeyConditionExpression=condition,
+        ScanIndexForward=True,
+        Limit=PAGE_SIZE
+    )
+    return [item for item in response.get('Items', []) if item['postId'] != since_id]
+
 def lambda_handler(event, context):
     try:
         print(f"Event: {json.dumps(event)}")
-        
+
         # Get the table name from environment variables
         table_name = os.environ.get('POSTS_TABLE')
         table = dynamodb.Table(table_name)
-        
-        # Query posts by timestamp (most recent first)
-        response = table.query(
-            IndexName='TimestampIndex',
-            KeyConditionExpression=Key('dummy').eq('POST'),
-            ScanIndexForward=False,  # Sort in descending order (newest first)
-            Limit=50  # Limit to 50 posts
-        )
-        
+
+        # Optional watermark of the newest post the client has, `since` in milliseconds and its `sinceId`
+        params = event.get('queryStringParameters') or {}
+        if 'since' in params:
+            since = int(params['since'])
+            since_id = params.get('sinceId')
+            wait = min(int(params.get('wait', '0')), MAX_WAIT_SECONDS)
+            deadline = time.monotonic() + wait
+            items = query_newer(table, since, since_id)
+            # Bounded long-poll, answer as soon as something was published or once the wait is over
+            while not items and time.monotonic() + POLL_INTERVAL_SECONDS < deadline:
+                time.sleep(POLL_INTERVAL_SECONDS)
+                items = query_newer(table, since, since_id)
+            items.reverse()
+        else:
+            # Query posts by timestamp (most recent first)
+            response = table.query(
+                IndexName='TimestampIndex',
+                KeyConditionExpression=Key('dummy').eq('POST'),
+                ScanIndexForward=False,  # Sort in descending order (newest first)
+                Limit=PAGE_SIZE  # Limit to 50 posts
+            )
+            items = response.get('Items', [])
+
         # Return the posts
         return {
             'statusCode': 200,
@@ -40,12 +73,24 @@ def lambda_handler(event, context):
                 'Access-Control-Allow-Origin': '*',
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps(response.get('Items', []), cls=DecimalEncoder)
+            'body': json.dumps(items, cls=DecimalEncoder)
+        }
+
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Content-Type': 'application/json'
+            },
+            'body': json.dumps({'error': '`since` and `wait` must be integers'}, cls=DecimalEncoder)
         }
-        
+
     except Exception as e:
         print(f"Error: {str(e)}")
-        
+
         return {
             'statusCode': 500,
             'headers': {
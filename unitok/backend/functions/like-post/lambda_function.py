@@ -0,0 +1,112 @@
+import json
+import os
+import random
+import boto3
+import decimal
+from datetime import datetime
+from botocore.exceptions import ClientError
+
+# Initialize DynamoDB client
+dynamodb = boto3.resource('dynamodb')
+
+# Likes of a post are counted on LIKE_SHARDS counter items instead of the post item, so a popular post
+# spreads its writes over several partitions. Every like also writes a marker item per user, in the same
+# transaction, which makes liking idempotent. The rollup-likes function sums the shards onto the post.
+# LIKE_SHARDS must be the same for both functions.
+LIKE_SHARDS = int(os.environ.get('LIKE_SHARDS', '10'))
+# Transactions touching the same shard at the same time conflict, conflicting likes retry on another shard
+MAX_ATTEMPTS = 3
+
+# Helper class to convert a DynamoDB item to JSON
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, decimal.Decimal):
+            if o % 1 > 0:
+                return float(o)
+            else:
+                return int(o)
+        return super(DecimalEncoder, self).default(o)
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps(body, cls=DecimalEncoder)
+    }
+
+def shard_key(post_id, shard):
+    return f"{post_id}#shard#{shard}"
+
+def like_key(post_id, user_id):
+    return f"{post_id}#user#{user_id}"
+
+def count_like(table_name, post_id, user_id, shard):
+    dynamodb.meta.client.transact_write_items(
+        TransactItems=[
+            {
+                'Put': {
+                    'TableName': table_name,
+                    'Item': {
+                        'pk': like_key(post_id, user_id),
+                        'kind': 'like',
+                        'postId': post_id,
+                        'userId': user_id,
+                        'timestamp': int(datetime.now().timestamp() * 1000)
+                    },
+                    'ConditionExpression': 'attribute_not_exists(pk)'
+                }
+            },
+            {
+                'Update': {
+                    'TableName': table_name,
+                    'Key': {'pk': shard_key(post_id, shard)},
+                    'UpdateExpression': 'SET kind = :kind, postId = :post_id ADD likes :one',
+                    'ExpressionAttributeValues': {':kind': 'shard', ':post_id': post_id, ':one': 1}
+                }
+            }
+        ]
+    )
+
+def lambda_handler(event, context):
+    try:
+        print(f"Event: {json.dumps(event)}")
+
+        # Get the table name from environment variables
+        table_name = os.environ.get('LIKES_TABLE')
+
+        post_id = (event.get('pathParameters') or {}).get('postId')
+        request_body = json.loads(event.get('body') or '{}')
+        user_id = request_body.get('userId')
+
+        # Validate required fields
+        if not post_id:
+            return response(400, {'error': 'Post ID is required'})
+        if not user_id:
+            return response(400, {'error': 'User ID is required'})
+
+        # Record the like of the user and count it on a random shard, all or nothing
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                count_like(table_name, post_id, user_id, random.randrange(LIKE_SHARDS))
+                break
+            except ClientError as e:
+                codes = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                if codes and codes[0] == 'ConditionalCheckFailed':
+                    # The user already liked the post, liking again is a no-op
+                    return response(200, {'postId': post_id, 'liked': True, 'counted': False})
+                if 'TransactionConflict' not in codes or attempt == MAX_ATTEMPTS - 1:
+                    raise
+                # A concurrent like held the shard, try another one
+                print(f"Transaction conflict on post {post_id}, retrying on another shard")
+
+        return response(200, {'postId': post_id, 'liked': True, 'counted': True})
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
+        return response(500, {'error': 'Internal server error'})
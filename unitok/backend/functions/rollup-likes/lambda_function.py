@@ -0,0 +1,56 @@
+import os
+import boto3
+from botocore.exceptions import ClientError
+
+# Initialize DynamoDB client
+dynamodb = boto3.resource('dynamodb')
+
+# Sums the like counter shards of every post that received likes onto the `likes` attribute of the post,
+# so get-posts returns like counts without reading the shards. Triggered by the stream of the likes table,
+# filtered to shard updates and batched, so each post is rolled up at most once per batching window.
+# LIKE_SHARDS must match the like-post function.
+LIKE_SHARDS = int(os.environ.get('LIKE_SHARDS', '10'))
+
+def shard_key(post_id, shard):
+    return f"{post_id}#shard#{shard}"
+
+def count_likes(likes_table_name, post_id):
+    # Total of all shards of a post, shards that were never written count as 0
+    keys = [{'pk': shard_key(post_id, shard)} for shard in range(LIKE_SHARDS)]
+    total = 0
+    request = {likes_table_name: {'Keys': keys, 'ProjectionExpression': 'likes'}}
+    while request:
+        response = dynamodb.batch_get_item(RequestItems=request)
+        total += sum(int(item.get('likes', 0)) for item in response['Responses'].get(likes_table_name, []))
+        request = response.get('UnprocessedKeys')
+    return total
+
+def rollup(posts_table_name, likes_table_name, post_id):
+    likes = count_likes(likes_table_name, post_id)
+    try:
+        # Likes only ever grow, an older rollup finishing late never overwrites a newer total
+        dynamodb.Table(posts_table_name).update_item(
+            Key={'postId': post_id},
+            UpdateExpression='SET likes = :likes',
+            ConditionExpression='attribute_exists(postId) AND (attribute_not_exists(likes) OR likes < :likes)',
+            ExpressionAttributeValues={':likes': likes}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    return likes
+
+def lambda_handler(event, context):
+    posts_table_name = os.environ.get('POSTS_TABLE')
+    likes_table_name = os.environ.get('LIKES_TABLE')
+
+    post_ids = {
+        record['dynamodb']['NewImage']['postId']['S']
+        for record in event.get('Records', [])
+        if 'NewImage' in record.get('dynamodb', {})
+    }
+    print(f"Rolling up likes of {len(post_ids)} posts from {len(event.get('Records', []))} records")
+    for post_id in post_ids:
+        likes = rollup(posts_table_name, likes_table_name, post_id)
+        print(f"Post {post_id} has {likes} likes")
+    return {'posts': len(post_ids)}
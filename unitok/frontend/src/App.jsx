@@ -1,14 +1,44 @@
 import axios from 'axios';
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import './App.css';
 import Feed from './components/Feed';
 import Header from './components/Header';
 
+// Pause between polls for new posts, each poll is a cheap incremental `since` query
+const POLL_INTERVAL_MS = 10000;
+const POLL_RETRY_MS = 5000;
+// Upper bound of posts kept in the feed as new ones are merged in
+const MAX_POSTS = 200;
+
+// New posts replace known ones with the same postId, the feed stays sorted newest first
+const mergePosts = (current, delta) => {
+  const byId = new Map(current.map(post => [post.postId, post]));
+  delta.forEach(post => byId.set(post.postId, { ...byId.get(post.postId), ...post }));
+  return [...byId.values()]
+    .sort((a, b) => b.timestamp - a.timestamp)
+    .slice(0, MAX_POSTS);
+};
+
+// Anonymous id of this browser, makes liking a post idempotent per viewer
+const getUserId = () => {
+  let userId = localStorage.getItem('unitokUserId');
+  if (!userId) {
+    userId = crypto.randomUUID();
+    localStorage.setItem('unitokUserId', userId);
+  }
+  return userId;
+};
+
 function App() {
   const [posts, setPosts] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [config, setConfig] = useState(null);
+  // Watermark for incremental fetches, a ref so the polling loop always sees the latest one
+  const latestPost = useRef(null);
+  latestPost.current = posts.reduce(
+    (newest, post) => (!newest || post.timestamp > newest.timestamp ? post : newest), null
+  );
 
   // Load configuration
   useEffect(() => {
@@ -45,6 +75,62 @@ function App() {
     fetchPosts();
   }, [config]);
 
+  // Poll for posts newer than the newest one shown and merge them in, instead of re-fetching the feed.
+  // Setting longPollSeconds in config.json makes get-posts hold each poll open until posts arrive,
+  // which keeps a Lambda busy per viewer, so plain polls on an interval are the default.
+  useEffect(() => {
+    if (!config || loading || error) return;
+
+    let active = true;
+    const sleep = ms => new Promise(resolve => setTimeout(resolve, ms));
+    const longPollSeconds = config.longPollSeconds || 0;
+    const pollNewPosts = async () => {
+      while (active) {
+        const newest = latestPost.current;
+        try {
+          const params = newest ? { since: newest.timestamp, sinceId: newest.postId } : { since: 0 };
+          if (longPollSeconds > 0) {
+            params.wait = longPollSeconds;
+          }
+          const response = await axios.get(`${config.apiEndpoint}/posts`, { params });
+          if (active && response.data.length > 0) {
+            setPosts(current => mergePosts(current, response.data));
+          }
+          if (longPollSeconds <= 0) {
+            await sleep(POLL_INTERVAL_MS);
+          }
+        } catch (err) {
+          console.error('Error polling for new posts:', err);
+          await sleep(POLL_RETRY_MS);
+        }
+      }
+    };
+
+    pollNewPosts();
+    return () => { active = false; };
+  }, [config, loading, error]);
+
+  // Like counts are rolled up periodically, so the like is counted locally right away
+  const likePost = async (postId) => {
+    setPosts(current => current.map(post =>
+      post.postId === postId ? { ...post, likes: post.likes + 1, liked: true } : post
+    ));
+    try {
+      const response = await axios.post(`${config.apiEndpoint}/posts/${postId}/like`, { userId: getUserId() });
+      if (!response.data.counted) {
+        // Liked before, the stored count already includes it
+        setPosts(current => current.map(post =>
+          post.postId === postId ? { ...post, likes: post.likes - 1 } : post
+        ));
+      }
+    } catch (err) {
+      console.error('Error liking post:', err);
+      setPosts(current => current.map(post =>
+        post.postId === postId ? { ...post, likes: post.likes - 1, liked: false } : post
+      ));
+    }
+  };
+
   return (
     <div className="app">
       <Header />
@@ -60,7 +146,7 @@ function App() {
             <button onClick={() => window.location.reload()}>Try Again</button>
           </div>
         ) : (
-          <Feed posts={posts} />
+          <Feed posts={posts} onLike={likePost} />
         )}
       </main>
       <footer className="footer">
@@ -1,7 +1,7 @@
 import './Feed.css';
 import Post from './Post';
 
-const Feed = ({ posts }) => {
+const Feed = ({ posts, onLike }) => {
   if (!posts || posts.length === 0) {
     return (
       <div className="empty-feed">
@@ -14,7 +14,7 @@ const Feed = ({ posts }) => {
   return (
     <div className="feed">
       {posts.map(post => (
-        <Post key={post.postId} post={post} />
+        <Post key={post.postId} post={post} onLike={onLike} />
       ))}
     </div>
   );
@@ -1,8 +1,8 @@
 import { FaHeart, FaHorse } from 'react-icons/fa';
 import './Post.css';
 
-const Post = ({ post }) => {
-  const { content, author, timestamp, likes, unicornColor } = post;
+const Post = ({ post, onLike }) => {
+  const { postId, content, author, timestamp, likes, unicornColor, liked } = post;
   
   // Format the timestamp
   const formattedDate = new Date(timestamp).toLocaleString();
@@ -41,10 +41,15 @@ const Post = ({ post }) => {
       <div className="post-content">{content}</div>
       
       <div className="post-footer">
-        <div className="post-likes">
+        <button
+          className={`post-likes${liked ? ' liked' : ''}`}
+          onClick={() => onLike && onLike(postId)}
+          disabled={liked}
+          aria-label="Like post"
+        >
           <FaHeart className="like-icon" />
           <span>{likes}</span>
-        </div>
+        </button>
         <div className="post-unicorn-color">
           <span className="color-label">Unicorn Color:</span>
           <span className="color-value" style={unicornStyle}>{unicornColor}</span>
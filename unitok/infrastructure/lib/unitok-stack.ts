@@ -4,6 +4,7 @@ import * as cloudfront from 'aws-cdk-lib/aws-cloudfront';
 import * as origins from 'aws-cdk-lib/aws-cloudfront-origins';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
 import * as s3 from 'aws-cdk-lib/aws-s3';
 import * as s3deploy from 'aws-cdk-lib/aws-s3-deployment';
 import { DeployTimeSubstitutedFile } from 'aws-cdk-lib/aws-s3-deployment';
@@ -12,14 +13,20 @@ import * as fs from 'fs';
 import * as path from 'path';
 
 export class UniTokStack extends cdk.Stack {
+  // Like counter shards per post, shared by the like-post and rollup-likes functions
+  private static readonly LIKE_SHARDS = 10;
+  // Upper bound on how long a like takes to show up in get-posts
+  private static readonly LIKE_ROLLUP_SECONDS = 30;
+
   constructor(scope: Construct, id: string, props?: cdk.StackProps) {
     super(scope, id, props);
 
     // 1. Database resources
     const postsTable = this.createDatabaseResources();
+    const likesTable = this.createLikesResources(postsTable);
     
     // 2. API resources (depends on database)
-    const apiEndpoint = this.createApiResources(postsTable);
+    const apiEndpoint = this.createApiResources(postsTable, likesTable);
     
     // 3. Frontend resources (depends on API)
     this.createFrontendResources(apiEndpoint);
@@ -27,7 +34,7 @@ export class UniTokStack extends cdk.Stack {
     const strandsLayer = this.createStrandsLambdaLayer();
     
     // 4. Outputs
-    this.createOutputs(postsTable, apiEndpoint,strandsLayer);
+    this.createOutputs(postsTable, likesTable, apiEndpoint,strandsLayer);
   }
 
   /**
@@ -53,10 +60,53 @@ export class UniTokStack extends cdk.Stack {
     return postsTable;
   }
 
+  /**
+   * Creates the DynamoDB table for sharded like counters and the function rolling them up onto posts
+   */
+  private createLikesResources(postsTable: dynamodb.Table): dynamodb.Table {
+    // Holds LIKE_SHARDS counter items per post ('<postId>#shard#<n>') and one item per like ('<postId>#user#<userId>')
+    const likesTable = new dynamodb.Table(this, 'LikesTable', {
+      partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY, // For demo purposes only
+      pointInTimeRecovery: true,
+      stream: dynamodb.StreamViewType.NEW_IMAGE,
+    });
+
+    // Periodically sums the shards of liked posts onto the post item
+    const rollupLikesFunction = new lambda.Function(this, 'RollupLikesFunction', {
+      runtime: lambda.Runtime.PYTHON_3_11,
+      handler: 'lambda_function.lambda_handler',
+      code: lambda.Code.fromAsset(path.join(__dirname, '../../backend/functions/rollup-likes')),
+      environment: {
+        POSTS_TABLE: postsTable.tableName,
+        LIKES_TABLE: likesTable.tableName,
+        LIKE_SHARDS: String(UniTokStack.LIKE_SHARDS),
+      },
+      timeout: cdk.Duration.seconds(60),
+      memorySize: 256,
+    });
+    likesTable.grantReadData(rollupLikesFunction);
+    postsTable.grantWriteData(rollupLikesFunction);
+
+    // Only shard updates trigger a rollup, batched so a hot post is rolled up once per window
+    rollupLikesFunction.addEventSource(new lambdaEventSources.DynamoEventSource(likesTable, {
+      startingPosition: lambda.StartingPosition.LATEST,
+      batchSize: 1000,
+      maxBatchingWindow: cdk.Duration.seconds(UniTokStack.LIKE_ROLLUP_SECONDS),
+      retryAttempts: 3,
+      filters: [
+        lambda.FilterCriteria.filter({ dynamodb: { NewImage: { kind: { S: lambda.FilterRule.isEqual('shard') } } } }),
+      ],
+    }));
+
+    return likesTable;
+  }
+
   /**
    * Creates the API Gateway and Lambda functions
    */
-  private createApiResources(postsTable: dynamodb.Table): string {
+  private createApiResources(postsTable: dynamodb.Table, likesTable: dynamodb.Table): string {
     // Create Lambda function for publishing posts
     const publishPostFunction = new lambda.Function(this, 'PublishPostFunction', {
       runtime: lambda.Runtime.PYTHON_3_11,
@@ -81,9 +131,23 @@ export class UniTokStack extends cdk.Stack {
       memorySize: 256,
     });
 
+    // Create Lambda function for liking posts
+    const likePostFunction = new lambda.Function(this, 'LikePostFunction', {
+      runtime: lambda.Runtime.PYTHON_3_11,
+      handler: 'lambda_function.lambda_handler',
+      code: lambda.Code.fromAsset(path.join(__dirname, '../../backend/functions/like-post')),
+      environment: {
+        LIKES_TABLE: likesTable.tableName,
+        LIKE_SHARDS: String(UniTokStack.LIKE_SHARDS),
+      },
+      timeout: cdk.Duration.seconds(30),
+      memorySize: 256,
+    });
+
     // Grant permissions to Lambda functions
     postsTable.grantReadWriteData(publishPostFunction);
     postsTable.grantReadData(getPostsFunction);
+    likesTable.grantWriteData(likePostFunction);
 
     // Create API Gateway
     const api = new apigateway.RestApi(this, 'UniTokApi', {
@@ -104,6 +168,10 @@ export class UniTokStack extends cdk.Stack {
     // POST /posts
     postsResource.addMethod('POST', new apigateway.LambdaIntegration(publishPostFunction));
 
+    // POST /posts/{postId}/like
+    const likeResource = postsResource.addResource('{postId}').addResource('like');
+    likeResource.addMethod('POST', new apigateway.LambdaIntegration(likePostFunction));
+
     return api.url;
   }
 
@@ -197,7 +265,7 @@ export class UniTokStack extends cdk.Stack {
   /**
    * Creates the stack outputs
    */
-  private createOutputs(postsTable: dynamodb.Table, apiEndpoint: string,strandsLayer: lambda.LayerVersion): void {
+  private createOutputs(postsTable: dynamodb.Table, likesTable: dynamodb.Table, apiEndpoint: string,strandsLayer: lambda.LayerVersion): void {
 
     new cdk.CfnOutput(this, 'Strandslayer', {
       value: strandsLayer.layerVersionArn,
@@ -215,6 +283,11 @@ export class UniTokStack extends cdk.Stack {
       description: 'The ARN of the posts table',
     });
 
+    new cdk.CfnOutput(this, 'LikesTableName', {
+      value: likesTable.tableName,
+      description: 'The name of the sharded like counters table',
+    });
+
     // API outputs
     new cdk.CfnOutput(this, 'ApiEndpoint', {
       value: apiEndpoint,